@@ -7,14 +7,15 @@
 
 import asyncio
 import threading
-from collections import deque
-from typing import Deque, Tuple, Optional
+from typing import Tuple, Optional
 
+import numpy as np
 import pandas as pd
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 from bleak import BleakScanner, BleakClient
 
+from csv_kernel import parse_rows, parse_lines, fromstring_rows  # parse_rows is None without Numba
+
 # ---------------- Config ----------------
 TARGET_NAME = "XIAO-Sense-BLE"  # must match Bluefruit setName() in your Arduino sketch
 NUS_SERVICE_UUID = "6e400001-b5a3-f393-e0a9-e50e24dcca9e"
@@ -22,54 +23,93 @@ NUS_TX_CHAR      = "6e400003-b5a3-f393-e0a9-e50e24dcca9e"  # notify
 NUS_RX_CHAR      = "6e400002-b5a3-f393-e0a9-e50e24dcca9e"  # write (optional)
 
 MAX_POINTS = 600        # ~60 s at 10 Hz
-REFRESH_MS = 200        # UI refresh cadence
+REFRESH_MS = 500        # live-view heartbeat
+CHART_REBUILD = 4 * MAX_POINTS  # rows appended via add_rows before the chart is rebuilt from the ring
 
 st.set_page_config(page_title="XIAO Sense BLE → Streamlit", layout="wide")
 st.title("XIAO nRF52840 Sense → Streamlit via BLE (Nordic UART)")
 
+# ---------------- Sample buffers (shared with the BLE thread) ----------------
+# Streamlit re-executes this file on every rerun, so the buffers live in a
+# cached resource. The notify callback touches only these, never session_state.
+@st.cache_resource
+def _sample_buffers():
+    ring = np.empty((MAX_POINTS, 3), dtype=np.float32)  # rows of (t, v1, v2)
+    idx = [0]                                            # total samples written; slot is idx % MAX_POINTS
+    return ring, idx, bytearray(), threading.Lock()
+
+_RING, _IDX, _BUF, _LOCK = _sample_buffers()
+
 # ---------------- Session state ----------------
-if "loop" not in st.session_state:
-    st.session_state.loop: Optional[asyncio.AbstractEventLoop] = None
-if "loop_thread" not in st.session_state:
-    st.session_state.loop_thread: Optional[threading.Thread] = None
-if "devices" not in st.session_state:
-    st.session_state.devices = []
+if "dev_map" not in st.session_state:
+    st.session_state.dev_map = {}  # "name [address]" label -> address, built once per scan
 if "selected_addr" not in st.session_state:
     st.session_state.selected_addr: Optional[str] = None
 if "client" not in st.session_state:
     st.session_state.client: Optional[BleakClient] = None
 if "connected" not in st.session_state:
     st.session_state.connected = False
-if "queue" not in st.session_state:
-    st.session_state.queue: Deque[Tuple[float, float, float]] = deque(maxlen=MAX_POINTS)
-if "buffer" not in st.session_state:
-    st.session_state.buffer = ""
+if "chart" not in st.session_state:
+    st.session_state.chart = None       # line_chart handle fed with add_rows
+    st.session_state.chart_base = 0     # sample count when the chart was (re)built
+    st.session_state.plotted_idx = 0    # sample count already sent to the chart
+if "shown_connected" not in st.session_state:
+    st.session_state.shown_connected = False
+if "mtu" not in st.session_state:
+    st.session_state.mtu = None
 if "listen_future" not in st.session_state:
     st.session_state.listen_future = None
 
 # ---------------- Utilities ----------------
-def ensure_loop_thread():
-    """Create an asyncio loop running forever in a daemon thread (once)."""
-    if st.session_state.loop and st.session_state.loop_thread and st.session_state.loop_thread.is_alive():
-        return
+@st.cache_resource(validate=lambda loop: not loop.is_closed())
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Process-wide asyncio loop running forever in a daemon thread, shared by all sessions."""
     loop = asyncio.new_event_loop()
-    st.session_state.loop = loop
 
     def run_loop():
         asyncio.set_event_loop(loop)
         loop.run_forever()
 
-    t = threading.Thread(target=run_loop, name="BLE-Loop-Thread", daemon=True)
-    t.start()
-    st.session_state.loop_thread = t
+    threading.Thread(target=run_loop, name="BLE-Loop-Thread", daemon=True).start()
+    return loop
 
 def run_coro(coro):
     """Schedule coroutine onto our background loop and return a concurrent.futures.Future."""
-    ensure_loop_thread()
-    return asyncio.run_coroutine_threadsafe(coro, st.session_state.loop)
-
-def parse_line(line: str) -> Optional[Tuple[float, float, float]]:
-    parts = line.strip().split(",")
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def reset_ring():
+    with _LOCK:
+        _IDX[0] = 0
+        _BUF.clear()
+    st.session_state.chart = None
+
+def ring_rows(ring: np.ndarray, idx: int) -> np.ndarray:
+    """Return the filled part of the ring in arrival order."""
+    if idx <= MAX_POINTS:
+        return ring[:idx]
+    start = idx % MAX_POINTS
+    return np.concatenate((ring[start:], ring[:start]))
+
+def ring_write(ring: np.ndarray, idx: int, rows: np.ndarray) -> int:
+    """Copy `rows` into the ring after `idx` samples; return the new sample count."""
+    n = len(rows)
+    if n > MAX_POINTS:
+        idx += n - MAX_POINTS
+        rows = rows[-MAX_POINTS:]
+        n = MAX_POINTS
+    start = idx % MAX_POINTS
+    first = min(n, MAX_POINTS - start)
+    ring[start:start + first] = rows[:first]
+    ring[:n - first] = rows[first:]
+    return idx + n
+
+def chart_frame(rows: np.ndarray) -> pd.DataFrame:
+    """(n, 3) ring rows -> v1/v2 frame indexed by t, without a set_index copy."""
+    return pd.DataFrame(rows[:, 1:], index=pd.Index(rows[:, 0], name="t"), columns=["v1", "v2"])
+
+def parse_line(line: bytes) -> Optional[Tuple[float, float, float]]:
+    # float() accepts bytes (and ignores surrounding whitespace/CR), so no decode/strip
+    parts = line.split(b",")
     if len(parts) != 3:
         return None
     try:
@@ -77,12 +117,33 @@ def parse_line(line: str) -> Optional[Tuple[float, float, float]]:
     except ValueError:
         return None
 
+def parse_block(chunk: bytes) -> np.ndarray:
+    """Parse newline-separated 't,v1,v2' lines in one pass; returns an (n, 3) array."""
+    lines = [ln for ln in chunk.split(b"\n") if ln.strip()]
+    if not lines:
+        return np.empty((0, 3), dtype=np.float32)
+    if parse_rows is not None:
+        # Lines the kernel rejects (nan, odd spacing) are re-parsed by parse_line
+        return parse_lines(lines, 3, parse_line, np.float32)
+    arr = fromstring_rows(lines, 3, np.float32)
+    if arr is not None:
+        return arr
+    # Malformed or odd-width lines: fall back to per-line parsing
+    rows = [parse_line(ln) for ln in lines]
+    return np.array([r for r in rows if r], dtype=np.float32).reshape(-1, 3)
+
 # ---------------- BLE coroutines ----------------
 async def scan_for_devices() -> list:
     """Return list of discovered BLE devices."""
     devs = await BleakScanner.discover()
     return devs
 
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_scan() -> list:
+    """(name, address) pairs from a scan; repeat scans within 30 s reuse the result."""
+    devs = run_coro(scan_for_devices()).result(timeout=12)
+    return [(d.name, d.address) for d in devs]
+
 async def find_device_by_name(name: str, timeout: float = 12.0):
     """Find a device by advertised local name (more reliable on Windows)."""
     def _flt(d, ad):
@@ -94,6 +155,19 @@ async def find_device_by_name(name: str, timeout: float = 12.0):
     except Exception:
         return None
 
+async def read_mtu(client: BleakClient) -> Optional[int]:
+    """ATT MTU of the link as the backend reports it (None if it can't tell).
+
+    Reads only; no MTU exchange is requested. On BlueZ the value is fetched first
+    through the private `_backend._acquire_mtu` (not public Bleak API, absent on
+    other backends) so that `mtu_size` is accurate.
+    """
+    try:
+        await client._backend._acquire_mtu()
+    except Exception:
+        pass  # no private probe on this backend, or it failed: use mtu_size as is
+    return getattr(client, "mtu_size", None)
+
 async def connect_and_listen(address: str):
     """Connect to device and stream notifications from NUS TX characteristic."""
     # Clean previous client
@@ -107,24 +181,23 @@ async def connect_and_listen(address: str):
     await client.connect()
     st.session_state.client = client
     st.session_state.connected = await client.is_connected()
+    st.session_state.mtu = await read_mtu(client)
 
     def handle_notify(_, data: bytearray):
-        # Called on BLE thread; keep it tiny & thread-safe (touch only session_state)
-        try:
-            text = data.decode(errors="ignore")
-        except:
-            return
-        st.session_state.buffer += text
-        if "\n" in st.session_state.buffer:
-            lines = st.session_state.buffer.splitlines(keepends=False)
-            if not st.session_state.buffer.endswith("\n"):
-                st.session_state.buffer = lines.pop()
-            else:
-                st.session_state.buffer = ""
-            for ln in lines:
-                parsed = parse_line(ln)
-                if parsed:
-                    st.session_state.queue.append(parsed)
+        # Called on BLE thread; keep it tiny & thread-safe (touch only the shared buffers)
+        with _LOCK:
+            _BUF.extend(data)
+            last_nl = _BUF.rfind(b"\n")
+            if last_nl == -1:
+                return
+            # Copy complete lines out once; the view is released before the buffer shrinks
+            with memoryview(_BUF) as mv:
+                chunk = mv[:last_nl].tobytes()
+            del _BUF[:last_nl + 1]
+        rows = parse_block(chunk)
+        if len(rows):
+            with _LOCK:
+                _IDX[0] = ring_write(_RING, _IDX[0], rows)
 
     await client.start_notify(NUS_TX_CHAR, handle_notify)
 
@@ -162,20 +235,15 @@ with col1:
 
     # Optional: list scan
     do_scan = st.button("Scan BLE devices (show list)")
-    options = []
     if do_scan:
-        fut = run_coro(scan_for_devices())
         try:
-            devs = fut.result(timeout=12)
+            devs = cached_scan()
         except Exception as e:
             st.error(f"Scan failed: {e}")
             devs = []
-        st.session_state.devices = devs
+        st.session_state.dev_map = {f"{name or 'Unknown'} [{addr}]": addr for name, addr in devs}
 
-    for d in st.session_state.devices:
-        name = d.name or "Unknown"
-        label = f"{name} [{d.address}]"
-        options.append(label)
+    options = list(st.session_state.dev_map)
 
     choice = st.selectbox(
         "Pick device from scan (optional)",
@@ -184,19 +252,21 @@ with col1:
         placeholder="Click 'Scan BLE devices (show list)' to populate",
     )
     if choice:
-        st.session_state.selected_addr = choice.split("[")[-1].rstrip("]").strip()
+        st.session_state.selected_addr = st.session_state.dev_map[choice]
 
 with col2:
     connect_sel = st.button("Connect (use selection)")
     disconnect_clicked = st.button("Disconnect")
 
 with col3:
+    st.session_state.shown_connected = st.session_state.connected
     st.metric("Status", "Connected" if st.session_state.connected else "Disconnected")
+    if st.session_state.connected and st.session_state.mtu:
+        st.caption(f"MTU: {st.session_state.mtu} bytes")
 
 # --- Connection logic ---
 if quick and not st.session_state.connected:
-    st.session_state.queue.clear()
-    st.session_state.buffer = ""
+    reset_ring()
     dev = run_coro(find_device_by_name(TARGET_NAME)).result(timeout=14)
     if dev is None:
         st.error(f"'{TARGET_NAME}' not found. Ensure the board is advertising and not already connected.")
@@ -205,8 +275,7 @@ if quick and not st.session_state.connected:
         st.session_state.listen_future = run_coro(connect_and_listen(dev.address))
 
 if connect_sel and st.session_state.selected_addr and not st.session_state.connected:
-    st.session_state.queue.clear()
-    st.session_state.buffer = ""
+    reset_ring()
     try:
         st.session_state.listen_future = run_coro(connect_and_listen(st.session_state.selected_addr))
     except Exception as e:
@@ -219,27 +288,43 @@ if disconnect_clicked and st.session_state.connected:
         st.warning(f"Disconnect issue: {e}")
 
 # --- Live view ---
-raw_placeholder = st.empty()
-chart_placeholder = st.empty()
-
-if st.session_state.queue:
-    tail = list(st.session_state.queue)[-10:]
-    raw_lines = [f"{t:.3f},{v1:.3f},{v2:.3f}" for (t, v1, v2) in tail]
-    raw_placeholder.code("\n".join(raw_lines), language="text")
-
-    df = pd.DataFrame(st.session_state.queue, columns=["t", "v1", "v2"])
-    chart_placeholder.line_chart(df.set_index("t")[["v1", "v2"]])
-else:
-    raw_placeholder.info("Waiting for BLE data… (connect your XIAO and ensure it sends lines)")
+# Only this fragment reruns on the heartbeat; scan/connect code above runs on user input only.
+@st.fragment(run_every=REFRESH_MS / 1000)
+def live_view():
+    if st.session_state.connected != st.session_state.shown_connected:
+        st.rerun()  # connection finished/dropped in the background: refresh the status widgets
+
+    with _LOCK:
+        snap = _RING.copy()
+        idx = _IDX[0]
+    if idx:
+        rows = ring_rows(snap, idx)
+        tail = rows[-10:]
+        raw_lines = [f"{t:.3f},{v1:.3f},{v2:.3f}" for (t, v1, v2) in tail]
+        st.code("\n".join(raw_lines), language="text")
+
+        ss = st.session_state
+        new_n = idx - ss.plotted_idx
+        if ss.chart is None or new_n < 0 or new_n > MAX_POINTS or idx - ss.chart_base > CHART_REBUILD:
+            # First paint, reconnect or too far behind: rebuild from the whole ring
+            ss.chart = st.line_chart(chart_frame(rows))
+            ss.chart_base = idx
+        else:
+            # Send only the delta; called even when empty so the element stays current
+            ss.chart.add_rows(chart_frame(rows[len(rows) - new_n:]))
+        ss.plotted_idx = idx
+    else:
+        st.session_state.chart = None
+        st.info("Waiting for BLE data… (connect your XIAO and ensure it sends lines)")
 
-# Smooth periodic UI refresh (no st.autorefresh in core Streamlit)
-st_autorefresh(interval=REFRESH_MS, key="ble_autorefresh")
+live_view()
 
 # ---------------- Help ----------------
 with st.expander("Troubleshooting & Tips"):
     st.markdown("""
 - **No pairing needed** in Windows Bluetooth settings for Nordic UART. If already paired and scan is flaky, **remove device** in Settings and try again.
 - Make sure your Arduino sketch advertises as **XIAO-Sense-BLE** and sends one **newline-terminated CSV** line per sample.
+- For higher sample rates, have the sketch **batch several lines per notification** (e.g. 8 samples per `writeValue`, at most MTU − 3 bytes) instead of one notify per sample.
 - If the XIAO LED is **solid ON**, it’s already connected to something (e.g., phone / nRF Connect). Disconnect other centrals and try again.
 - Windows sometimes requires **Location ON** to allow BLE scanning: Settings → Privacy & security → Location.
 - To send commands back (optional), write to **NUS_RX_CHAR** from another button/callback:
@@ -1,7 +1,8 @@
 # app_ble_fast.py — Streamlit BLE LED controller (persistent connection)
 # pip install -U streamlit bleak
 
-import sys, time, threading, asyncio
+import re, sys, threading, asyncio
+import concurrent.futures
 import streamlit as st
 from bleak import BleakScanner, BleakClient
 
@@ -36,6 +37,12 @@ class BLEManager:
         self.addr: str | None = None
         self.last_reply: str = ""
         self.connected: bool = False
+        # Replies in arrival order; created on the loop that consumes it
+        self._replies: asyncio.Queue[str] = self.run(self._make_queue(), 2)
+
+    @staticmethod
+    async def _make_queue() -> asyncio.Queue:
+        return asyncio.Queue(maxsize=16)
 
     def stop(self):
         if self.client:
@@ -50,13 +57,25 @@ class BLEManager:
 
     def _notify(self, _h, data: bytearray):
         try:
-            self.last_reply = data.decode(errors="ignore").strip()
+            text = data.decode(errors="ignore").strip()
         except Exception:
-            self.last_reply = repr(data)
+            text = repr(data)
+        self.loop.call_soon_threadsafe(self._push_reply, text)
+
+    def _push_reply(self, text: str):
+        """Runs on the loop: keep every reply, dropping the oldest when full."""
+        self.last_reply = text
+        if self._replies.full():
+            self._replies.get_nowait()
+        self._replies.put_nowait(text)
+
+    def _on_disconnect(self, _client: BleakClient):
+        # Keeps `connected` accurate so the hot path never queries the backend
+        self.connected = False
 
     async def _connect(self, addr: str):
         self.addr = addr
-        self.client = BleakClient(addr)
+        self.client = BleakClient(addr, disconnected_callback=self._on_disconnect)
         await self.client.connect()
         if not self.client.is_connected:  # property (no parentheses)
             raise RuntimeError("BLE not connected")
@@ -75,50 +94,86 @@ class BLEManager:
             self.connected = False
             self.client = None
 
+    def run(self, coro, timeout: float):
+        """Run a coroutine on the background loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout=timeout)
+
     def connect(self, addr: str):
-        return asyncio.run_coroutine_threadsafe(self._connect(addr), self.loop).result(timeout=8)
+        return self.run(self._connect(addr), 8)
 
     def disconnect(self):
-        return asyncio.run_coroutine_threadsafe(self._disconnect(), self.loop).result(timeout=5)
+        return self.run(self._disconnect(), 5)
 
-    def send(self, text: str):
-        """Fire-and-forget write; returns quickly."""
-        if not (self.client and self.client.is_connected):
+    def send_nowait(self, text: str) -> concurrent.futures.Future:
+        """Queue a write on the BLE loop and return its future without waiting."""
+        if not self.connected:
             raise RuntimeError("Not connected")
         self.last_reply = ""
         coro = self.client.write_gatt_char(RX_UUID, (text + "\n").encode(), response=False)
-        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout=3)
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        fut.add_done_callback(self._record_write_error)
+        return fut
+
+    def _record_write_error(self, fut: concurrent.futures.Future):
+        # Surface failed fire-and-forget writes (pulse buttons) in the UI's "Last reply"
+        if not fut.cancelled() and fut.exception() is not None:
+            self.last_reply = f"(write failed: {fut.exception()})"
+
+    def send(self, text: str):
+        """Fire-and-forget write; returns quickly."""
+        return self.send_nowait(text).result(timeout=3)
+
+    async def _send_and_wait(self, text: str, timeout_s: float) -> str:
+        while not self._replies.empty():  # replies to earlier fire-and-forget writes
+            self._replies.get_nowait()
+        await self.client.write_gatt_char(RX_UUID, (text + "\n").encode(), response=False)
+        try:
+            return await asyncio.wait_for(self._replies.get(), timeout_s)
+        except asyncio.TimeoutError:
+            return "(no reply)"
 
     def send_and_wait(self, text: str, timeout_s: float = 2.0) -> str:
         """Send and wait (briefly) for a notify reply."""
-        self.send(text)
-        t0 = time.perf_counter()
-        while time.perf_counter() - t0 < timeout_s:
-            if self.last_reply:
-                return self.last_reply
-            time.sleep(0.02)
-        return "(no reply)"
-
-# session-scoped BLE manager
-if "ble" not in st.session_state:
-    st.session_state.ble = BLEManager()
+        if not self.connected:
+            raise RuntimeError("Not connected")
+        return self.run(self._send_and_wait(text, timeout_s), timeout_s + 3)
+
+# One manager (one loop thread, one connection) per server process, shared by
+# every browser tab; Streamlit re-executes this file per rerun, so cache it.
+@st.cache_resource
+def get_ble_manager() -> BLEManager:
+    return BLEManager()
+
+ble: BLEManager = get_ble_manager()
 
 # ---------- helpers ----------
+_ADDR_RE = re.compile(r"[0-9A-Fa-f:\-]{12,}")
+
 def looks_like_address(s: str) -> bool:
     s = (s or "").strip()
-    return (":" in s) or (s.count("-") >= 5) or (len(s) >= 12 and all(c in "0123456789ABCDEF:-" for c in s.upper()))
+    return (":" in s) or (s.count("-") >= 5) or bool(_ADDR_RE.fullmatch(s))
 
 async def scan_for_name(name: str, timeout=5.0):
-    devs = await BleakScanner.discover(timeout=timeout)
-    for d in devs:
-        if (d.name or "").strip() == name:
-            return d
-    # loose
+    """Return the first advertiser whose name matches (exact or loose), without waiting out the timeout."""
     lname = name.lower()
-    for d in devs:
-        if d.name and lname in d.name.lower():
-            return d
-    return None
+    found = {}
+    ev = asyncio.Event()
+
+    def _cb(d, _adv):
+        dname = (d.name or "").strip()
+        if dname == name or (dname and lname in dname.lower()):
+            found.setdefault("d", d)
+            ev.set()
+
+    scanner = BleakScanner(_cb)
+    await scanner.start()
+    try:
+        await asyncio.wait_for(ev.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await scanner.stop()
+    return found.get("d")
 
 async def resolve_addr(addr_or_name: str) -> str:
     s = (addr_or_name or "").strip()
@@ -138,7 +193,7 @@ with colA:
 with colB:
     if st.button("Scan"):
         try:
-            dev = asyncio.run(scan_for_name(TARGET_NAME, timeout=6.0))
+            dev = ble.run(scan_for_name(TARGET_NAME, timeout=6.0), 8)
             if dev:
                 # Stage into pending and rerun; the priming block at the top will populate the widget next run.
                 st.session_state["pending_addr"] = dev.address
@@ -151,16 +206,15 @@ with colB:
 with colC:
     if st.button("Disconnect"):
         try:
-            st.session_state.ble.disconnect()
+            ble.disconnect()
             st.success("Disconnected.")
         except Exception as e:
             st.warning(f"Disconnect: {e}")
 
 # Connect if not connected and we have an address/name
-ble: BLEManager = st.session_state.ble
 if not ble.connected and st.session_state.get("ble_addr_name", "").strip():
     try:
-        addr = asyncio.run(resolve_addr(st.session_state["ble_addr_name"]))
+        addr = ble.run(resolve_addr(st.session_state["ble_addr_name"]), 8)
         if addr:
             ble.connect(addr)
             st.success(f"Connected to {addr}")
@@ -171,28 +225,30 @@ if not ble.connected and st.session_state.get("ble_addr_name", "").strip():
 
 st.divider()
 st.write(("Status: **connected**" if ble.connected else "Status: **not connected**"))
+if ble.last_reply:
+    st.caption(f"Last reply: {ble.last_reply}")
 
 col1, col2 = st.columns(2)
 with col1:
     if st.button("Pulse D7"):
         try:
-            st.write(ble.send_and_wait("7", timeout_s=0.5))
+            ble.send_nowait("7")
         except Exception as e:
             st.error(e)
     if st.button("Pulse D9"):
         try:
-            st.write(ble.send_and_wait("9", timeout_s=0.5))
+            ble.send_nowait("9")
         except Exception as e:
             st.error(e)
 with col2:
     if st.button("Pulse D8"):
         try:
-            st.write(ble.send_and_wait("8", timeout_s=0.5))
+            ble.send_nowait("8")
         except Exception as e:
             st.error(e)
     if st.button("Pulse D10"):
         try:
-            st.write(ble.send_and_wait("10", timeout_s=0.5))
+            ble.send_nowait("10")
         except Exception as e:
             st.error(e)
 
@@ -3,6 +3,7 @@
 #   pip install streamlit pyserial
 
 import time
+import atexit
 import streamlit as st
 import serial
 import serial.tools.list_ports as list_ports
@@ -15,37 +16,67 @@ st.caption("Click a button to pulse an LED on D7 / D8 / D9 / D10 for 1 second.")
 def find_ports():
     return [p.device for p in list_ports.comports()]
 
-def try_ping(port: str, baud: int = 115200, timeout: float = 1.0) -> bool:
-    """Open port briefly and check for READY/PONG response."""
+REPLY_TIMEOUT_S = 1.5  # the sketch pulses the pin for 1 s before it answers
+PING_TTL_S = 5.0       # reuse a ping result this long before handshaking again
+
+def get_serial(port: str, baud: int = 115200, timeout: float = REPLY_TIMEOUT_S) -> serial.Serial:
+    """Return a persistent Serial handle for `port`, reopening only on port change."""
+    ser = st.session_state.get("ser")
+    if ser is not None and st.session_state.get("ser_port") == port and ser.is_open:
+        return ser
+    close_serial()
+    ser = serial.Serial(port, baudrate=baud, timeout=timeout)
+    atexit.register(ser.close)  # release the port when the server exits; unregistered in close_serial
+    time.sleep(0.2)  # let the board settle after the open-time DTR reset
+    ser.reset_input_buffer()
+    st.session_state.ser = ser
+    st.session_state.ser_port = port
+    return ser
+
+def close_serial():
+    ser = st.session_state.get("ser")
+    if ser is not None:
+        atexit.unregister(ser.close)
+        try:
+            ser.close()
+        except Exception:
+            pass
+    st.session_state.ser = None
+    st.session_state.ser_port = None
+
+def try_ping(port: str, force: bool = False) -> bool:
+    """Check for READY/PONG response on the persistent handle.
+
+    The result is kept per session for PING_TTL_S, so reruns don't re-handshake;
+    `force` skips the stored result.
+    """
+    last = st.session_state.get("ping")  # (port, ok, time of the ping)
+    if not force and last and last[0] == port and time.time() - last[2] < PING_TTL_S:
+        return last[1]
     try:
-        with serial.Serial(port, baudrate=baud, timeout=timeout) as ser:
-            time.sleep(0.2)
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
-            ser.write(b"PING\n")
-            line = ser.readline().decode(errors="ignore").strip()
-            # Accept "PONG" (reply to PING) or the initial "READY" banner
-            return ("PONG" in line) or ("READY" in line)
+        ser = get_serial(port)
+        ser.reset_input_buffer()
+        ser.write(b"PING\n")
+        line = ser.readline().decode(errors="ignore").strip()
+        # Accept "PONG" (reply to PING) or the initial "READY" banner
+        ok = ("PONG" in line) or ("READY" in line)
     except Exception:
-        return False
+        close_serial()
+        ok = False
+    st.session_state.ping = (port, ok, time.time())
+    return ok
 
-def send_cmd(port: str, cmd: str, baud: int = 115200, timeout: float = 2.0) -> str:
+def send_cmd(ser: serial.Serial, cmd: str) -> str:
     """Send a single-line command ('7','8','9','10') and read one short reply."""
     try:
-        with serial.Serial(port, baudrate=baud, timeout=timeout) as ser:
-            time.sleep(0.05)
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
-            ser.write((cmd + "\n").encode())
-            t_end = time.time() + 1.2
-            reply = ""
-            while time.time() < t_end:
-                line = ser.readline().decode(errors="ignore").strip()
-                if line:
-                    reply = line
-                    break
-            return reply or "(no reply)"
+        ser.write((cmd + "\n").encode())
+        # One bounded read: replies are at most "OK D10\r\n"
+        reply = ser.read_until(b"\n", 16).decode(errors="ignore").strip()
+        if not reply:
+            ser.reset_input_buffer()  # drop a late reply so it can't answer the next command
+        return reply or "(no reply)"
     except Exception as e:
+        close_serial()
         return f"(error: {e})"
 
 # ---------- Port picker ----------
@@ -53,7 +84,7 @@ ports = find_ports()
 if "xiao_port" not in st.session_state:
     st.session_state.xiao_port = ports[0] if ports else ""
 
-colA, colB = st.columns([3, 1])
+colA, colB, colC = st.columns([3, 1, 1])
 with colA:
     current = st.session_state.xiao_port
     options = [""] + ports
@@ -67,6 +98,8 @@ with colA:
 with colB:
     if st.button("Refresh"):
         st.rerun()
+with colC:
+    test_clicked = st.button("Test connection")
 
 if selected:
     st.session_state.xiao_port = selected
@@ -74,7 +107,14 @@ if selected:
 # ---------- Connection test (corrected display) ----------
 status = st.empty()
 if st.session_state.xiao_port:
-    ok = try_ping(st.session_state.xiao_port)
+    ser = st.session_state.get("ser")
+    if test_clicked:
+        ok = try_ping(st.session_state.xiao_port, force=True)
+    elif ser is not None and ser.is_open and st.session_state.get("ser_port") == st.session_state.xiao_port:
+        # Trust the open OS handle instead of re-handshaking on every rerun
+        ok = True
+    else:
+        ok = try_ping(st.session_state.xiao_port)
     if ok:
         status.success(f"Connected to {st.session_state.xiao_port}")
     else:
@@ -93,24 +133,24 @@ col1, col2 = st.columns(2)
 with col1:
     if st.button("Pulse D7"):
         if ok:
-            st.write(send_cmd(st.session_state.xiao_port, "7"))
+            st.write(send_cmd(get_serial(st.session_state.xiao_port), "7"))
         else:
             st.error("Not connected.")
     if st.button("Pulse D9"):
         if ok:
-            st.write(send_cmd(st.session_state.xiao_port, "9"))
+            st.write(send_cmd(get_serial(st.session_state.xiao_port), "9"))
         else:
             st.error("Not connected.")
 
 with col2:
     if st.button("Pulse D8"):
         if ok:
-            st.write(send_cmd(st.session_state.xiao_port, "8"))
+            st.write(send_cmd(get_serial(st.session_state.xiao_port), "8"))
         else:
             st.error("Not connected.")
     if st.button("Pulse D10"):
         if ok:
-            st.write(send_cmd(st.session_state.xiao_port, "10"))
+            st.write(send_cmd(get_serial(st.session_state.xiao_port), "10"))
         else:
             st.error("Not connected.")
 
@@ -0,0 +1,123 @@
+# csv_kernel.py — block parsers for numeric CSV rows (compiled one optional: needs Numba)
+# Shared by the XIAO apps; each app keeps its own per-line parser as the fallback,
+# so a line parses the same whether or not Numba is installed.
+
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def _parse_row(buf, start, end, out):
+    """Parse exactly len(out) comma-separated numbers from buf[start:end] (uint8) into out.
+
+    Spaces, tabs and '\\r' around fields are skipped. Returns False for anything
+    else (comments, label:value lines, nan/inf, extra or missing fields), leaving
+    the line to the caller's per-line parser.
+    """
+    ncols = out.shape[0]
+    i = start
+    col = 0
+    while col < ncols:
+        while i < end and (buf[i] == 32 or buf[i] == 9 or buf[i] == 13):  # ' ' / '\t' / '\r'
+            i += 1
+        sign = 1.0
+        if i < end and (buf[i] == 45 or buf[i] == 43):  # '-' / '+'
+            sign = -1.0 if buf[i] == 45 else 1.0
+            i += 1
+        mant = 0.0
+        scale = 1.0
+        digits = 0
+        seen_dot = False
+        while i < end:
+            c = int(buf[i])
+            if 48 <= c <= 57:
+                mant = mant * 10.0 + (c - 48)
+                if seen_dot:
+                    scale *= 10.0
+                digits += 1
+            elif c == 46 and not seen_dot:  # '.'
+                seen_dot = True
+            else:
+                break
+            i += 1
+        if digits == 0:
+            return False
+        exp = 0
+        if i < end and (buf[i] == 101 or buf[i] == 69):  # 'e' / 'E'
+            i += 1
+            esign = 1
+            if i < end and (buf[i] == 45 or buf[i] == 43):
+                esign = -1 if buf[i] == 45 else 1
+                i += 1
+            edigits = 0
+            while i < end and 48 <= buf[i] <= 57:
+                exp = exp * 10 + (int(buf[i]) - 48)
+                edigits += 1
+                i += 1
+            if edigits == 0:
+                return False
+            exp *= esign
+        while i < end and (buf[i] == 32 or buf[i] == 9 or buf[i] == 13):
+            i += 1
+        out[col] = sign * mant / scale * 10.0 ** exp
+        col += 1
+        if col < ncols:
+            if i >= end or buf[i] != 44:  # ','
+                return False
+            i += 1
+    return i == end
+
+def _compile():
+    if njit is None:
+        return None
+    row = njit(cache=True, nogil=True)(_parse_row)
+
+    @njit(cache=True, nogil=True)
+    def rows(buf, starts, ends, out, ok):
+        # Whole block in one compiled call: no per-line dispatch back into Python
+        for k in range(len(starts)):
+            ok[k] = row(buf, starts[k], ends[k], out[k])
+    return rows
+
+# Compiled once per process (this module is imported, not re-run by Streamlit); None without Numba
+parse_rows = _compile()
+
+def parse_lines(lines: Sequence[bytes], ncols: int, fallback: Callable[[bytes], Optional[tuple]],
+                dtype=np.float64) -> np.ndarray:
+    """Parse complete, non-empty lines into an (n, ncols) array with the compiled kernel.
+
+    Lines the kernel rejects are handed to `fallback` (the app's per-line parser);
+    those it also rejects are dropped. Requires Numba (`parse_rows` is not None).
+    """
+    lens = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    ends = np.cumsum(lens + 1) - 1
+    starts = ends - lens
+    out = np.empty((len(lines), ncols), dtype=dtype)
+    ok = np.zeros(len(lines), dtype=np.bool_)
+    parse_rows(np.frombuffer(b"\n".join(lines), dtype=np.uint8), starts, ends, out, ok)
+    if ok.all():
+        return out
+    for i in np.flatnonzero(~ok):
+        r = fallback(lines[i])
+        if r:
+            out[i] = r
+            ok[i] = True
+    return out[ok]
+
+def fromstring_rows(lines: Sequence[bytes], ncols: int, dtype=np.float64) -> Optional[np.ndarray]:
+    """Non-Numba fast path: parse complete lines with one np.fromstring call.
+
+    Only taken when every line has exactly ncols - 1 commas, so a short line next to
+    a long one can't be stitched into shifted rows. Returns None when the block
+    doesn't qualify or a value doesn't parse; the caller then parses line by line.
+    """
+    if any(ln.count(b",") != ncols - 1 for ln in lines):
+        return None
+    try:
+        arr = np.fromstring(b",".join(lines), dtype=dtype, sep=",")
+    except ValueError:
+        return None
+    return arr.reshape(-1, ncols) if arr.size == ncols * len(lines) else None
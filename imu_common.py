@@ -0,0 +1,176 @@
+# imu_common.py — record layout, buffers and chart helpers shared by the XIAO IMU apps (no Streamlit calls here)
+
+import io
+import os
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["t", "ax", "ay", "az", "gx", "gy", "gz"]  # record layout: t then accel and gyro
+ACC_COLS, GYRO_COLS = slice(1, 4), slice(4, 7)
+EXPECTED_KEYS = ("ax", "ay", "az", "gx", "gy", "gz")
+_KEY_SLOT = {k.encode(): i for i, k in enumerate(EXPECTED_KEYS)}  # label -> fixed column offset
+
+def parse_key_values(s: bytes) -> Optional[Tuple[float, float, float, float, float, float, float]]:
+    """'ax:.. ay:.. az:.. gx:.. gy:.. gz:..' (any order, other tokens ignored) -> (0.0, ax..gz).
+
+    None unless all six keys are present and every value is a float.
+    """
+    vals = [0.0] * 6
+    seen = 0  # bit i set once EXPECTED_KEYS[i] has been read
+    for tok in s.split():
+        k, sep, v = tok.partition(b":")
+        i = _KEY_SLOT.get(k) if sep else None
+        if i is None: continue
+        try: vals[i] = float(v)
+        except ValueError: return None
+        seen |= 1 << i
+    if seen == 0x3F:
+        return (0.0, *vals)
+    return None
+
+class SPSCRing:
+    """Single-producer/single-consumer ring of (t, ax..gz) float32 records.
+
+    Only the reader thread advances `head` and only the UI advances `tail`,
+    each after its copy, so neither side takes a lock.
+    """
+    def __init__(self, capacity: int):
+        self.buf = np.empty((capacity, 7), dtype=np.float32)
+        self.capacity = capacity
+        self.head = 0  # records written (producer)
+        self.tail = 0  # records read (consumer)
+
+    def __len__(self) -> int:
+        return self.head - self.tail
+
+    def write(self, rows: np.ndarray) -> int:
+        """Producer: copy as many rows as fit (the rest are dropped); returns the count."""
+        n = min(len(rows), self.capacity - (self.head - self.tail))
+        start = self.head % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start + first] = rows[:first]
+        self.buf[:n - first] = rows[first:n]
+        self.head += n  # publish only after the copy
+        return n
+
+    def read(self) -> np.ndarray:
+        """Consumer: copy out everything published so far."""
+        head = self.head
+        start, n = self.tail % self.capacity, head - self.tail
+        if start + n <= self.capacity:
+            out = self.buf[start:start + n].copy()
+        else:
+            out = np.concatenate((self.buf[start:], self.buf[:start + n - self.capacity]))
+        self.tail = head
+        return out
+
+# The on-screen window: `state` is the app's session state holding `ring` (capacity, 7)
+# and `ring_head`, the total rows ever written (slot is head % capacity).
+def ring_write(state, rows: np.ndarray) -> None:
+    """Copy `rows` into state.ring after the current head (wrapping as needed)."""
+    cap = len(state.ring)
+    n = len(rows)
+    head = state.ring_head
+    if n > cap:
+        head += n - cap
+        rows = rows[-cap:]
+        n = cap
+    start = head % cap
+    first = min(n, cap - start)
+    state.ring[start:start + first] = rows[:first]
+    state.ring[:n - first] = rows[first:]
+    state.ring_head = head + n
+
+def ring_since(state, idx: int) -> np.ndarray:
+    """Rows written after monotone index `idx` (at most the ring's capacity), oldest first."""
+    cap = len(state.ring)
+    head = state.ring_head
+    idx = max(idx, head - cap, 0)
+    if idx >= head:
+        return state.ring[:0].copy()
+    start, end = idx % cap, head % cap
+    if start < end:
+        return state.ring[start:end].copy()
+    return np.concatenate((state.ring[start:], state.ring[:end]))
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of `n_out` rows that keep the shape of y(x).
+
+    `y` may hold several series (n, k); each bucket keeps the row whose triangle
+    area, summed over the series, is largest.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    y = y.reshape(n, -1)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)  # interior bucket bounds
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt = slice(hi, edges[i + 2] if i + 2 < len(edges) else n)
+        cx, cy = x[nxt].mean(), y[nxt].mean(axis=0)
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi])[:, None] * (cy - y[a])).sum(axis=1)
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+def chart_delta(rows: np.ndarray, cols: slice, n_out: int) -> pd.DataFrame:
+    """Columns `cols` of `rows` indexed by t, LTTB-reduced to at most `n_out` points."""
+    if len(rows) > n_out:
+        rows = rows[lttb_indices(rows[:, 0], rows[:, cols], n_out)]
+    return pd.DataFrame(rows[:, cols], index=pd.Index(rows[:, 0], name="t"), columns=COLUMNS[cols])
+
+def _discard(fh, path: str) -> None:
+    try: fh.close()
+    except OSError: pass
+    try: os.remove(path)
+    except OSError: pass
+
+def open_temp_csv(header: list, buffering: int = 1 << 20):
+    """Temp CSV opened for appending, with `header` already written; returns (file, remove).
+
+    remove() closes and deletes the file. It also runs by itself once the handle is
+    garbage-collected (a Streamlit session dropped without Stop) or at interpreter
+    exit, so an abandoned session does not leave its CSV in the temp directory.
+    """
+    f = tempfile.NamedTemporaryFile(mode="wb", buffering=buffering, suffix=".csv", delete=False)
+    f.write((",".join(header) + "\n").encode())
+    return f, weakref.finalize(f, _discard, f.file, f.name)
+
+def csv_bytes(arr: np.ndarray, fmt: str = "%.7g", header: bool = False) -> bytes:
+    """Encode an (n, 7) sample array as CSV rows, optionally under a COLUMNS header."""
+    sink = io.BytesIO()
+    np.savetxt(sink, arr, fmt=fmt, delimiter=",",
+               header=",".join(COLUMNS) if header else "", comments="")
+    return sink.getvalue()
+
+# Whole-session log streamed to disk: `state` holds session_file, session_cleanup, session_n.
+def open_session_file(state) -> None:
+    """Fresh on-disk session log with the COLUMNS header; rows are appended as they arrive."""
+    close_session_file(state)
+    state.session_file, state.session_cleanup = open_temp_csv(COLUMNS)
+
+def close_session_file(state) -> bytes:
+    """Close and delete the session log, returning its contents."""
+    f, state.session_file = state.session_file, None
+    if f is None:
+        return b""
+    f.close()
+    try:
+        return Path(f.name).read_bytes()
+    finally:
+        state.session_cleanup()
+
+def session_append(state, rows: np.ndarray) -> None:
+    """Append `rows` to the on-disk session log (buffered; nothing is kept in RAM)."""
+    if state.session_file is not None:
+        state.session_file.write(csv_bytes(rows))
+    state.session_n += len(rows)
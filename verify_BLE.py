@@ -1,5 +1,6 @@
 # find_xiao_nus_compat.py
 import asyncio
+import heapq
 from bleak import BleakClient, BleakScanner
 
 NUS_SERVICE = "6e400001-b5a3-f393-e0a9-e50e24dcca9e"  # Nordic UART Service UUID (lowercase)
@@ -26,8 +27,8 @@ async def main():
         return
 
     # Try strongest first
-    addrs = sorted(seen.items(), key=lambda kv: kv[1]["rssi"], reverse=True)
-    addrs = [addr for addr, _ in addrs[:12]]
+    top = heapq.nlargest(12, seen.items(), key=lambda kv: kv[1]["rssi"])
+    addrs = [addr for addr, _ in top]
 
     for addr in addrs:
         meta = seen[addr]
@@ -58,13 +59,12 @@ async def main():
                     print("  ✅ Found Nordic UART Service on", addr)
                     # Optional: try to read GAP device name (2A00)
                     GAP_DEVICE_NAME = "00002a00-0000-1000-8000-00805f9b34fb"
+                    chars = {ch.uuid.lower(): ch for s in services for ch in s.characteristics}
                     try:
-                        for s in services:
-                            for ch in s.characteristics:
-                                if ch.uuid.lower() == GAP_DEVICE_NAME and "read" in ch.properties:
-                                    nm = await client.read_gatt_char(ch.uuid)
-                                    print("  Device Name:", nm.decode("utf-8", "ignore"))
-                                    break
+                        ch = chars.get(GAP_DEVICE_NAME)
+                        if ch is not None and "read" in ch.properties:
+                            nm = await client.read_gatt_char(ch.uuid)
+                            print("  Device Name:", nm.decode("utf-8", "ignore"))
                     except Exception:
                         pass
                     return
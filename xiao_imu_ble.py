@@ -4,22 +4,28 @@
 import asyncio
 import time
 import threading
-import queue
-from collections import deque
 from typing import Optional, Tuple, List
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 from streamlit_autorefresh import st_autorefresh
 from bleak import BleakClient, BleakScanner, BLEDevice
 
+from csv_kernel import parse_rows, parse_lines, fromstring_rows  # parse_rows is None without Numba
+from imu_common import COLUMNS, parse_key_values, ring_write, ring_since, csv_bytes
+
 # ---------------- Config ----------------
-REFRESH_MS = 250            # UI cadence
+REFRESH_MS = 250            # UI cadence until a sample rate is known
+REFRESH_MIN_MS = 100        # adaptive cadence bounds
+REFRESH_MAX_MS = 1000
+ROWS_PER_REFRESH = 50       # aim for about this many new rows per rerun
 RING = 4000                 # points kept on-screen
+LOG_CHUNK = 65536           # rows per preallocated CSV-log chunk
+RAW_RING_BYTES = 1 << 16    # reader-side notify byte ring
 CSV_NAME_BASE = "data_xiao"
 NUS_SERVICE = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E".lower()
 NUS_TX_CHAR = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E".lower()  # notify from peripheral→host
-EXPECTED_KEYS = ("ax","ay","az","gx","gy","gz")
 
 # Connection robustness
 FAST_START_WAIT_S = 1.0
@@ -43,9 +49,15 @@ for k, v in {
     "connected": False,
     "last_error": "",
     "t0": None,
-    "q_parsed": queue.Queue(maxsize=20000),
-    "data": deque(maxlen=RING),
-    "all_rows": [],
+    "rate_ewma": None,                        # smoothed samples/s, drives the refresh cadence
+    "last_pump_t": None,
+    "parsed": [],                             # (n, 7) float64 batches parsed by the reader thread
+    "parsed_lock": threading.Lock(),
+    "ring": np.empty((RING, 7)),              # SoA-friendly (RING, 7) sample ring
+    "ring_head": 0,                           # total rows written; slot is head % RING
+    "ring_lock": threading.Lock(),
+    "log_chunks": [],                         # full-session log: list of (LOG_CHUNK, 7) arrays
+    "log_pos": 0,                             # rows used in log_chunks[-1]
     # Persistent chart placeholders & objects
     "acc_ph": None, "gyro_ph": None,
     "acc_chart": None, "gyro_chart": None,
@@ -57,39 +69,78 @@ for k, v in {
     ss.setdefault(k, v)
 
 # ---------------- Helpers ----------------
-def parse_csv_line(line: str) -> Optional[Tuple[float,float,float,float,float,float,float]]:
-    s = line.strip()
-    if not s or s.startswith("#") or s.startswith("err"):
+# Specialized row parser for the fixed COLUMNS layout, generated once at import:
+# one float() per field, no generator and no length branch.
+_FAST_ROW_SRC = "def _fast_parse_row(p):\n    return (%s)\n" % ", ".join(
+    f"float(p[{i}])" for i in range(len(COLUMNS)))
+_fast_ns: dict = {}
+exec(compile(_FAST_ROW_SRC, "<_fast_parse_row>", "exec"), _fast_ns)
+_fast_parse_row = _fast_ns["_fast_parse_row"]
+
+def parse_csv_row(buf: bytes) -> Optional[Tuple[float,float,float,float,float,float,float]]:
+    s = buf.strip()
+    if not s or s[:1] in (b"#", b"e"):  # comments / "err..." lines
         return None
     # CSV t,ax,ay,az,gx,gy,gz
-    if "," in s and ":" not in s:
-        parts = s.split(",")
-        if len(parts) >= 7:
-            try:
-                t, ax, ay, az, gx, gy, gz = (float(x) for x in parts[:7])
-                return (t, ax, ay, az, gx, gy, gz)
-            except ValueError:
-                return None
+    if b":" not in s:
+        try:
+            return _fast_parse_row(s.split(b",", 7))
+        except (ValueError, IndexError):
+            return None
     # label:value fallback (ax:.. ay:..)
-    if ":" in s:
-        kv = {}
-        for tok in s.split():
-            if ":" not in tok: continue
-            k, v = tok.split(":", 1)
-            if k in EXPECTED_KEYS:
-                try: kv[k] = float(v)
-                except ValueError: return None
-        if all(k in kv for k in EXPECTED_KEYS):
-            return (0.0, kv["ax"], kv["ay"], kv["az"], kv["gx"], kv["gy"], kv["gz"])
-    return None
-
-def safe_decode(b: bytes) -> str:
-    return b.decode(errors="ignore")
+    return parse_key_values(s)
+
+def parse_csv_block(lines: List[bytes]) -> np.ndarray:
+    """Parse complete lines in one pass; returns an (n, 7) array of t,ax,ay,az,gx,gy,gz."""
+    lines = [ln for ln in lines if ln]
+    if not lines:
+        return np.empty((0, 7))
+    if parse_rows is not None:
+        # Whole block in one compiled call; label:value lines and comments go to parse_csv_row
+        return parse_lines(lines, 7, parse_csv_row)
+    arr = fromstring_rows(lines, 7)
+    if arr is not None:
+        return arr
+    # Slow path: label:value lines, comments or malformed/extra-width rows
+    rows = [r for r in (parse_csv_row(ln) for ln in lines) if r]
+    return np.array(rows, dtype=np.float64).reshape(-1, 7)
 
 def label_for(d: BLEDevice) -> str:
     nm = d.name or "Unknown"
     return f"{nm} — {d.address}"
 
+class NotifyRing:
+    """Fixed-size byte ring between notify callbacks and the parser task.
+
+    Both sides run on the reader's event loop, so no lock is needed.
+    """
+    def __init__(self, size: int = RAW_RING_BYTES):
+        self.buf = bytearray(size)
+        self.size = size
+        self.head = self.tail = 0  # monotone byte counts; slot is count % size
+        self.ready = asyncio.Event()
+
+    def write(self, data: bytes) -> None:
+        pos = self.head % self.size
+        first = min(len(data), self.size - pos)
+        self.buf[pos:pos + first] = data[:first]
+        self.buf[:len(data) - first] = data[first:]
+        self.head += len(data)
+        self.ready.set()
+
+    def take_lines(self) -> List[bytes]:
+        """Complete lines written since the last call; the partial tail stays in the ring."""
+        self.tail = max(self.tail, self.head - self.size)  # overrun: skip overwritten bytes
+        start, n = self.tail % self.size, self.head - self.tail
+        if start + n <= self.size:
+            block = bytes(self.buf[start:start + n])
+        else:
+            block = bytes(self.buf[start:]) + bytes(self.buf[:start + n - self.size])
+        # One pass: CR -> LF, split, keep the trailing partial line for next time
+        lines = block.replace(b"\r", b"\n").split(b"\n")
+        self.tail = self.head - len(lines.pop())
+        return lines
+
 # ---------------- BLE scan (sync wrapper, returns BLEDevice objects) ----------------
 def do_scan(timeout: float = 4.0) -> List[Tuple[str, BLEDevice]]:
     async def _scan():
@@ -105,34 +156,29 @@ def do_scan(timeout: float = 4.0) -> List[Tuple[str, BLEDevice]]:
 
 # ---------------- BLE reader thread with robust connect/reconnect ----------------
 def ble_reader_thread(dev: BLEDevice, stop_event: threading.Event,
-                      q_parsed: "queue.Queue", err_holder: list, conn_flag: list):
+                      parsed: list, parsed_lock: threading.Lock, t0: float,
+                      first_data: threading.Event,
+                      err_holder: list, conn_flag: list):
     async def run():
-        buffer = bytearray()
+        # Notify callbacks only copy into the byte ring; a separate parser task
+        # turns whatever has piled up into one float64 batch per lock.
+        ring = NotifyRing()
 
         def handle_notify(_: int, data: bytearray):
-            nonlocal buffer
-            buffer += data
-            # Split on CR/LF
+            ring.write(data)
+
+        async def parser_task():
             while True:
-                npos = buffer.find(b"\n")
-                rpos = buffer.find(b"\r")
-                term = -1
-                if npos != -1 and rpos != -1: term = min(npos, rpos)
-                elif npos != -1: term = npos
-                elif rpos != -1: term = rpos
-                if term == -1:
-                    break
-                line = safe_decode(buffer[:term])
-                drop = term + 1
-                if drop < len(buffer) and buffer[drop:drop+1] in (b"\n", b"\r"):
-                    drop += 1
-                del buffer[:drop]
-                parsed = parse_csv_line(line)
-                if parsed:
-                    try:
-                        q_parsed.put_nowait(parsed)
-                    except queue.Full:
-                        pass
+                await ring.ready.wait()
+                ring.ready.clear()
+                arr = parse_csv_block(ring.take_lines())
+                if len(arr):
+                    arr[:, 0] = time.time() - t0
+                    with parsed_lock:
+                        parsed.append(arr)
+                    first_data.set()
+
+        parser = asyncio.create_task(parser_task())
 
         async def connect_once() -> Optional[BleakClient]:
             # Resolve a fresh device handle (addresses can be RPA on Win10)
@@ -164,33 +210,34 @@ def ble_reader_thread(dev: BLEDevice, stop_event: threading.Event,
             err_holder[:] = [f"Connect failed: {type(last_exc).__name__}: {last_exc}"] if last_exc else ["Connect failed"]
             return None
 
-        async def start_notifications(client: BleakClient) -> bool:
+        tx_char = None  # resolved NUS TX characteristic, reused across reconnects
+
+        async def resolve_tx_char(client: BleakClient):
             # Characteristic lookup by UUID (lower-cased)
-            char = None
             try:
                 svcs = client.services or await client.get_services()
                 for s in svcs:
                     for c in s.characteristics:
                         if (c.uuid or "").lower() == NUS_TX_CHAR:
-                            char = c
-                            break
-                    if char:
-                        break
+                            return c
             except Exception:
-                char = None
-
-            if char is None:
-                # Fall back to direct UUID anyway
-                char = NUS_TX_CHAR
+                pass
+            # Fall back to direct UUID anyway
+            return NUS_TX_CHAR
 
+        async def start_notifications(client: BleakClient) -> bool:
+            nonlocal tx_char
             last_exc: Optional[Exception] = None
             for i in range(NOTIFY_RETRIES):
+                if tx_char is None:
+                    tx_char = await resolve_tx_char(client)
                 try:
                     await asyncio.sleep(POST_NOTIFY_DELAY_S)
-                    await client.start_notify(char, handle_notify)
+                    await client.start_notify(tx_char, handle_notify)
                     return True
                 except Exception as e:
                     last_exc = e
+                    tx_char = None  # handle may be stale after a reconnect: look it up again
                     await asyncio.sleep(0.3 + 0.2 * i)
             err_holder[:] = [f"Notify start failed: {type(last_exc).__name__}: {last_exc}"] if last_exc else ["Notify start failed"]
             return False
@@ -242,6 +289,9 @@ def ble_reader_thread(dev: BLEDevice, stop_event: threading.Event,
             # Unexpected disconnect: auto-reconnect with backoff
             await asyncio.sleep(RECONNECT_BACKOFF_S)
 
+        parser.cancel()
+        await asyncio.gather(parser, return_exceptions=True)
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(run())
@@ -253,21 +303,29 @@ def start_reader(dev: BLEDevice):
     # reset state
     ss.stop_event = threading.Event()
     ss.last_error = ""
-    ss.data.clear()
-    ss.all_rows = []
+    with ss.ring_lock:
+        ss.ring_head = 0
+    ss.log_chunks = []
+    ss.log_pos = 0
+    with ss.parsed_lock:
+        ss.parsed.clear()
     ss.download_bytes = b""
     ss.download_name = ""
     ss.acc_chart = None
     ss.gyro_chart = None
     ss.plotted_n = 0
     ss.t0 = time.time()
+    ss.rate_ewma = None
+    ss.last_pump_t = None
 
     err_holder = [""]
     conn_flag = [False]
+    first_data = threading.Event()
     th = threading.Thread(
         target=ble_reader_thread,
         name="BLE-Reader",
-        args=(dev, ss.stop_event, ss.q_parsed, err_holder, conn_flag),
+        args=(dev, ss.stop_event, ss.parsed, ss.parsed_lock, ss.t0, first_data,
+              err_holder, conn_flag),
         daemon=True
     )
     th.start()
@@ -279,12 +337,8 @@ def start_reader(dev: BLEDevice):
     ss.connected = conn_flag[0]
 
     # ---------- FAST-START: wait briefly for first packet & drain ----------
-    t_deadline = time.time() + FAST_START_WAIT_S
-    while time.time() < t_deadline:
-        if not ss.q_parsed.empty():
-            break
-        time.sleep(0.02)
-    pump_queue_into_buffers(repeat=3)
+    first_data.wait(FAST_START_WAIT_S)
+    pump_queue_into_buffers()
     st.rerun()
 
 def stop_reader_and_save():
@@ -294,33 +348,68 @@ def stop_reader_and_save():
     ss.reader_thread = None
     ss.stop_event = None
     ss.connected = False
-    if ss.all_rows:
-        df = pd.DataFrame(ss.all_rows, columns=["t","ax","ay","az","gx","gy","gz"])
-        ss.download_bytes = df.to_csv(index=False).encode("utf-8")
+    if ss.log_chunks:
+        ss.download_bytes = csv_bytes(log_array(), "%.9g", header=True)
         ts = time.strftime("%Y%m%d_%H%M%S")
         ss.download_name = f"{CSV_NAME_BASE}_{ts}.csv"
         st.success("Data ready. Use the download button below.")
 
-def pump_queue_into_buffers(repeat: int = 1) -> int:
-    total = 0
-    for _ in range(max(1, repeat)):
-        added = 0
-        while True:
-            try:
-                row = ss.q_parsed.get_nowait()
-            except queue.Empty:
-                break
-            t, ax, ay, az, gx, gy, gz = row
-            t_rel = (time.time() - ss.t0) if ss.t0 else (t if t else 0.0)
-            full = (t_rel, ax, ay, az, gx, gy, gz)
-            ss.data.append(full)
-            ss.all_rows.append(full)
-            added += 1
-        total += added
-        if added == 0:
-            break
-        time.sleep(0.01)
-    return total
+def drain_parsed() -> np.ndarray:
+    """Take every batch the reader has parsed so far; returns an (n, 7) array."""
+    with ss.parsed_lock:
+        if not ss.parsed:
+            return np.empty((0, 7))
+        batches = ss.parsed[:]
+        ss.parsed.clear()
+    return batches[0] if len(batches) == 1 else np.concatenate(batches)
+
+def chart_frames(rows: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Acc and gyro frames over column views of `rows`, both indexed by t."""
+    t = pd.Index(rows[:, 0], name="t")
+    acc = pd.DataFrame(rows[:, 1:4], index=t, columns=COLUMNS[1:4], copy=False)
+    gyro = pd.DataFrame(rows[:, 4:7], index=t, columns=COLUMNS[4:7], copy=False)
+    return acc, gyro
+
+def log_append(rows: np.ndarray) -> None:
+    """Copy `rows` into the preallocated log chunks, adding a chunk when the last is full."""
+    i = 0
+    while i < len(rows):
+        if not ss.log_chunks or ss.log_pos == LOG_CHUNK:
+            ss.log_chunks.append(np.empty((LOG_CHUNK, 7)))
+            ss.log_pos = 0
+        k = min(len(rows) - i, LOG_CHUNK - ss.log_pos)
+        ss.log_chunks[-1][ss.log_pos:ss.log_pos + k] = rows[i:i + k]
+        ss.log_pos += k
+        i += k
+
+def log_array() -> np.ndarray:
+    """Whole-session log as one (n, 7) array."""
+    parts = ss.log_chunks[:-1] + [ss.log_chunks[-1][:ss.log_pos]]
+    return np.concatenate(parts)
+
+def refresh_interval_ms() -> int:
+    """Rerun cadence that yields ~ROWS_PER_REFRESH new rows at the observed rate."""
+    if ss.rate_ewma is None:
+        return REFRESH_MS
+    if ss.rate_ewma <= 0:
+        return REFRESH_MAX_MS
+    ms = 1000.0 * ROWS_PER_REFRESH / ss.rate_ewma
+    return int(min(max(ms, REFRESH_MIN_MS), REFRESH_MAX_MS))
+
+def pump_queue_into_buffers() -> int:
+    """Move everything received so far into the ring and log; never blocks."""
+    arr = drain_parsed()
+    now = time.time()
+    if ss.last_pump_t is not None and now > ss.last_pump_t:
+        rate = len(arr) / (now - ss.last_pump_t)
+        ss.rate_ewma = rate if ss.rate_ewma is None else 0.9 * ss.rate_ewma + 0.1 * rate
+    ss.last_pump_t = now
+    if len(arr) == 0:
+        return 0
+    with ss.ring_lock:
+        ring_write(ss, arr)
+    log_append(arr)
+    return len(arr)
 
 # ---------------- Fixed placeholders (charts never flicker) ----------------
 if ss.acc_ph is None or ss.gyro_ph is None:
@@ -368,23 +457,26 @@ if stop_clicked:
     stop_reader_and_save()
 
 # ---------------- Data pump & charts ----------------
-pump_queue_into_buffers(repeat=3)
+pump_queue_into_buffers()
 
 # Seed charts once, then append only new rows
-if ss.acc_chart is None and len(ss.data):
-    df0 = pd.DataFrame([ss.data[-1]], columns=["t","ax","ay","az","gx","gy","gz"]).set_index("t")
-    ss.acc_chart  = ss.acc_ph.line_chart(df0[["ax","ay","az"]], use_container_width=True)
-    ss.gyro_chart = ss.gyro_ph.line_chart(df0[["gx","gy","gz"]], use_container_width=True)
-    ss.plotted_n = len(ss.data)
+if ss.acc_chart is None and ss.ring_head:
+    with ss.ring_lock:
+        rows0 = ring_since(ss, ss.ring_head - 1)
+    acc0, gyro0 = chart_frames(rows0)
+    ss.acc_chart  = ss.acc_ph.line_chart(acc0, use_container_width=True)
+    ss.gyro_chart = ss.gyro_ph.line_chart(gyro0, use_container_width=True)
+    ss.plotted_n = ss.ring_head
 
 if ss.acc_chart is not None:
-    n_total = len(ss.data)
+    n_total = ss.ring_head
     if n_total > ss.plotted_n:
-        new_slice = list(ss.data)[ss.plotted_n:n_total]
-        df_new = pd.DataFrame(new_slice, columns=["t","ax","ay","az","gx","gy","gz"]).set_index("t")
+        with ss.ring_lock:
+            rows = ring_since(ss, ss.plotted_n)
+        acc_new, gyro_new = chart_frames(rows)
         try:
-            ss.acc_chart.add_rows(df_new[["ax","ay","az"]])
-            ss.gyro_chart.add_rows(df_new[["gx","gy","gz"]])
+            ss.acc_chart.add_rows(acc_new)
+            ss.gyro_chart.add_rows(gyro_new)
         except Exception as e:
             ss.last_error = f"Chart update error: {e}"
         ss.plotted_n = n_total
@@ -408,4 +500,4 @@ if ss.download_bytes:
 
 # Auto-refresh only while connected
 if ss.connected:
-    st_autorefresh(interval=REFRESH_MS, key="ble_two_charts_refresh_fast")
+    st_autorefresh(interval=refresh_interval_ms(), key="ble_two_charts_refresh_fast")
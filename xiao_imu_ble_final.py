@@ -5,30 +5,35 @@
 #   TX notify char (peripheral→host): 6E400003-B5A3-F393-E0A9-E50E24DCCA9E
 
 import asyncio
+import concurrent.futures
 import time
 import threading
-import queue
 from collections import deque
 from typing import Optional, Tuple, List
 
+import numpy as np
 import pandas as pd
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 from bleak import BleakClient, BleakScanner
 from bleak.backends.device import BLEDevice
 from bleak.backends.scanner import AdvertisementData
 from bleak.backends.characteristic import BleakGATTCharacteristic
 
+from csv_kernel import parse_rows, parse_lines, fromstring_rows  # parse_rows is None without Numba
+from imu_common import (ACC_COLS, GYRO_COLS, SPSCRing, chart_delta, parse_key_values,
+                        ring_write, ring_since, open_session_file, close_session_file, session_append)
+
 # ---------------- Config ----------------
 REFRESH_MS = 250
 RING = 4000
+RX_CAPACITY = 20000         # reader → UI records in flight
+CHART_MAX_NEW = 200         # most points sent per chart per refresh (LTTB beyond this)
 CSV_NAME_BASE = "data_xiao"
 
 NUS_SERVICE = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E".lower()
 NUS_TX_CHAR = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E".lower()
 PREF_NAME = "XIAO-Sense-BLE"
 
-EXPECTED_KEYS = ("ax", "ay", "az", "gx", "gy", "gz")
 
 # Connection robustness
 FAST_START_WAIT_S = 1.0
@@ -52,10 +57,12 @@ for k, v in {
     "connected": False,
     "last_error": "",
     "t0": None,
-    "q_parsed": queue.Queue(maxsize=20000),
-    "data": deque(maxlen=RING),
-    "all_rows": [],
-    "acc_ph": None, "gyro_ph": None,
+    "rx_ring": None,                    # SPSCRing, reader thread → UI
+    "ring": np.empty((RING, 7), dtype=np.float32),      # on-screen window
+    "ring_head": 0,                                     # total rows written; slot is head % RING
+    "session_file": None,               # temp CSV the whole session is streamed into
+    "session_cleanup": None,            # deletes session_file (also on session GC)
+    "session_n": 0,
     "acc_chart": None, "gyro_chart": None,
     "plotted_n": 0,
     "download_bytes": b"",
@@ -64,33 +71,37 @@ for k, v in {
     ss.setdefault(k, v)
 
 # ---------------- Helpers ----------------
-def parse_csv_line(line: str) -> Optional[Tuple[float,float,float,float,float,float,float]]:
+def parse_csv_line(line: bytes) -> Optional[Tuple[float,float,float,float,float,float,float]]:
+    """Parse one raw line straight from bytes (float() accepts ASCII bytes; no decode)."""
     s = line.strip()
-    if not s or s.startswith("#") or s.startswith("err"):
+    if not s or s.startswith(b"#") or s.startswith(b"err"):
         return None
-    if "," in s and ":" not in s:
-        parts = s.split(",")
+    if b"," in s and b":" not in s:
+        parts = s.split(b",")
         if len(parts) >= 7:
             try:
                 t, ax, ay, az, gx, gy, gz = (float(x) for x in parts[:7])
                 return (t, ax, ay, az, gx, gy, gz)
             except ValueError:
                 return None
-    if ":" in s:
-        kv = {}
-        for tok in s.split():
-            if ":" not in tok: 
-                continue
-            k, v = tok.split(":", 1)
-            if k in EXPECTED_KEYS:
-                try: kv[k] = float(v)
-                except ValueError: return None
-        if all(k in kv for k in EXPECTED_KEYS):
-            return (0.0, kv["ax"], kv["ay"], kv["az"], kv["gx"], kv["gy"], kv["gz"])
+    if b":" in s:
+        return parse_key_values(s)
     return None
 
-def safe_decode(b: bytes) -> str:
-    return b.decode(errors="ignore")
+def parse_csv_block(lines: List[bytes]) -> np.ndarray:
+    """Parse complete lines in one pass; returns an (n, 7) float32 array of t,ax..gz."""
+    lines = [ln for ln in lines if ln]
+    if not lines:
+        return np.empty((0, 7), dtype=np.float32)
+    if parse_rows is not None:
+        # Whole block in one compiled call; label:value lines and comments go to parse_csv_line
+        return parse_lines(lines, 7, parse_csv_line, np.float32)
+    arr = fromstring_rows(lines, 7, np.float32)
+    if arr is not None:
+        return arr
+    # Slow path: label:value lines, comments or malformed/extra-width rows
+    rows = [r for r in (parse_csv_line(ln) for ln in lines) if r]
+    return np.array(rows, dtype=np.float32).reshape(-1, 7)
 
 def label_for(d: BLEDevice, ad: Optional[AdvertisementData] = None) -> str:
     nm = d.name or "Unknown"
@@ -105,6 +116,25 @@ def looks_like_xiao_nus(dev: BLEDevice, ad: Optional[AdvertisementData]) -> bool
     # Accept if either the name looks right OR it advertises NUS
     return name_ok or has_nus
 
+# ---------------- Background asyncio loop (shared by scan and stream) ----
+@st.cache_resource(validate=lambda loop: not loop.is_closed())
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Process-wide asyncio loop running forever in a daemon thread."""
+    loop = asyncio.new_event_loop()
+
+    def run_loop():
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    threading.Thread(target=run_loop, name="BLE-Loop-Thread", daemon=True).start()
+    return loop
+
+def submit(coro) -> concurrent.futures.Future:
+    """Schedule a coroutine on the background loop and return its Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+get_loop()  # start it on the script thread, before any Scan or reader needs it
+
 # ---------------- Scan (MAC-free list built from filters) ----------------
 def do_scan(timeout: float = 4.0) -> List[Tuple[str, BLEDevice]]:
     async def _scan():
@@ -126,46 +156,91 @@ def do_scan(timeout: float = 4.0) -> List[Tuple[str, BLEDevice]]:
         out.sort(key=lambda x: (0 if PREF_NAME in x[0] else 1, x[0]))
         return out
 
-    return asyncio.run(_scan())
-
-# ---------------- Resolve by name/service only (ignore MAC entirely) -----
-async def resolve_by_filter(timeout: float = 6.0) -> Optional[BLEDevice]:
-    def filt(d: BLEDevice, ad: AdvertisementData):
-        return looks_like_xiao_nus(d, ad)
-    try:
-        dev = await BleakScanner.find_device_by_filter(filt, timeout=timeout)
-        return dev
-    except Exception:
-        return None
+    return submit(_scan()).result(timeout=timeout + 5.0)
 
 # ---------------- BLE reader thread --------------------------------------
 def ble_reader_thread(initial_dev: Optional[BLEDevice], stop_event: threading.Event,
-                      q_parsed: "queue.Queue", err_holder: list, conn_flag: list):
+                      rx_ring: SPSCRing, err_holder: list, conn_flag: list):
+    # The notify callback only appends raw payloads; splitting and parsing run
+    # on a worker thread so the bleak loop goes straight back to the radio.
+    raw_q: deque = deque()
+    wake = threading.Event()
+
+    def parse_worker():
+        carry = b""  # trailing partial line carried to the next batch
+        while not stop_event.is_set():
+            wake.wait(0.2)
+            wake.clear()  # cleared before draining, so a later append always re-signals
+            if not raw_q:
+                continue
+            chunks = [carry]
+            while raw_q:
+                chunks.append(raw_q.popleft())
+            # One pass: CR -> LF, split, carry the trailing partial line (blank lines are skipped later)
+            lines = b"".join(chunks).replace(b"\r", b"\n").split(b"\n")
+            carry = lines.pop()
+            # Parse everything that piled up in one go; publish one (k, 7) slice
+            parsed = parse_csv_block(lines)
+            if len(parsed):
+                rx_ring.write(parsed)
+
     async def run():
-        buffer = bytearray()
+        tx_char = NUS_TX_CHAR  # characteristic object once resolved for the current connection
 
         def handle_notify(_: BleakGATTCharacteristic, data: bytearray):
-            nonlocal buffer
-            buffer += data
-            while True:
-                npos = buffer.find(b"\n")
-                rpos = buffer.find(b"\r")
-                term = -1
-                if npos != -1 and rpos != -1: term = min(npos, rpos)
-                elif npos != -1: term = npos
-                elif rpos != -1: term = rpos
-                if term == -1: break
-                line = safe_decode(buffer[:term])
-                drop = term + 1
-                if drop < len(buffer) and buffer[drop:drop+1] in (b"\n", b"\r"):
-                    drop += 1
-                del buffer[:drop]
-                parsed = parse_csv_line(line)
-                if parsed:
-                    try: q_parsed.put_nowait(parsed)
-                    except queue.Full: pass
+            raw_q.append(bytes(data))
+            if not wake.is_set():
+                wake.set()
+
+        def resolve_tx_char(client: BleakClient):
+            # Walk the (just refreshed) GATT table once per connection
+            try:
+                for s in client.services:
+                    for c in s.characteristics:
+                        if (c.uuid or "").lower() == NUS_TX_CHAR:
+                            return c
+            except Exception:
+                pass
+            # Fall back to the UUID string; bleak resolves it itself
+            return NUS_TX_CHAR
+
+        # One scanner reused across reconnects, running only while unconnected; connect attempts read its latest match
+        latest: List[BLEDevice] = []
+        seen = asyncio.Event()
+
+        def on_adv(d: BLEDevice, ad: AdvertisementData):
+            if looks_like_xiao_nus(d, ad):
+                latest[:] = [d]
+                seen.set()
+
+        scanner = BleakScanner(detection_callback=on_adv)
+        scanning = False
+
+        async def scan(on: bool) -> bool:
+            # Scanning competes with the link for radio time: run it only while looking for the board
+            nonlocal scanning
+            if scanning == on:
+                return True
+            try:
+                await (scanner.start() if on else scanner.stop())
+            except Exception as e:
+                if on:
+                    err_holder[:] = [f"Scan start failed: {type(e).__name__}: {e}"]
+                    return False
+            scanning = on
+            return True
+
+        async def resolve_by_filter(timeout: float) -> Optional[BLEDevice]:
+            # Resolve by name/service only (ignore MAC entirely): wait for an
+            # advertisement seen since the last connection, then use that device
+            try:
+                await asyncio.wait_for(seen.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+            return latest[0]
 
         async def connect_once() -> Optional[BleakClient]:
+            nonlocal tx_char
             # Always re-resolve the device by filter (ignore MAC/RPA)
             target = await resolve_by_filter(timeout=5.5)
             if target is None:
@@ -183,6 +258,9 @@ def ble_reader_thread(initial_dev: Optional[BLEDevice], stop_event: threading.Ev
                     except Exception:
                         pass
                     if client.is_connected:
+                        tx_char = resolve_tx_char(client)
+                        seen.clear()  # a reconnect must wait for a fresh advertisement
+                        await scan(False)
                         return client
                 except Exception as e:
                     last_exc = e
@@ -191,26 +269,11 @@ def ble_reader_thread(initial_dev: Optional[BLEDevice], stop_event: threading.Ev
             return None
 
         async def start_notifications(client: BleakClient) -> bool:
-            char = None
-            try:
-                svcs = client.services or await client.get_services_by_uuid()
-                for s in svcs:
-                    for c in s.characteristics:
-                        if (c.uuid or "").lower() == NUS_TX_CHAR:
-                            char = c
-                            break
-                    if char:
-                        break
-            except Exception:
-                char = None
-            if char is None:
-                char = NUS_TX_CHAR
-
             last_exc: Optional[Exception] = None
             for i in range(NOTIFY_RETRIES):
                 try:
                     await asyncio.sleep(POST_NOTIFY_DELAY_S)
-                    await client.start_notify(char, handle_notify)
+                    await client.start_notify(tx_char, handle_notify)
                     return True
                 except Exception as e:
                     last_exc = e
@@ -219,53 +282,66 @@ def ble_reader_thread(initial_dev: Optional[BLEDevice], stop_event: threading.Ev
             return False
 
         # Main loop: connect → notify → pump; reconnect on drop until Stop
-        while not stop_event.is_set():
-            client = await connect_once()
-            if client is None:
-                await asyncio.sleep(1.0)
-                continue
+        if not await scan(True):
+            return
+        try:
+            while not stop_event.is_set():
+                if not await scan(True):
+                    await asyncio.sleep(1.0)
+                    continue
+                client = await connect_once()
+                if client is None:
+                    await asyncio.sleep(1.0)
+                    continue
 
-            conn_flag[:] = [True]
-            err_holder[:] = [""]
+                conn_flag[:] = [True]
+                err_holder[:] = [""]
 
-            try:
-                ok = await start_notifications(client)
-                if not ok:
-                    await client.__aexit__(None, None, None)
-                    conn_flag[:] = [False]
-                    await asyncio.sleep(RECONNECT_BACKOFF_S)
-                    continue
+                try:
+                    ok = await start_notifications(client)
+                    if not ok:
+                        await client.__aexit__(None, None, None)
+                        conn_flag[:] = [False]
+                        await asyncio.sleep(RECONNECT_BACKOFF_S)
+                        continue
 
-                while not stop_event.is_set() and client.is_connected:
-                    await asyncio.sleep(0.1)
+                    while not stop_event.is_set() and client.is_connected:
+                        await asyncio.sleep(0.1)
 
-                try: await client.stop_notify(NUS_TX_CHAR)
-                except Exception: pass
+                    try: await client.stop_notify(tx_char)
+                    except Exception: pass
 
-            except Exception as e:
-                err_holder[:] = [f"{type(e).__name__}: {e}"]
-            finally:
-                try: await client.__aexit__(None, None, None)
-                except Exception: pass
-                conn_flag[:] = [False]
+                except Exception as e:
+                    err_holder[:] = [f"{type(e).__name__}: {e}"]
+                finally:
+                    try: await client.__aexit__(None, None, None)
+                    except Exception: pass
+                    conn_flag[:] = [False]
 
-            if stop_event.is_set():
-                break
+                if stop_event.is_set():
+                    break
 
-            await asyncio.sleep(RECONNECT_BACKOFF_S)
+                await scan(True)  # link dropped: collect advertisements again while backing off
+                await asyncio.sleep(RECONNECT_BACKOFF_S)
+        finally:
+            await scan(False)
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(run())
-    loop.close()
+    worker = threading.Thread(target=parse_worker, name="BLE-Parser", daemon=True)
+    worker.start()
+    try:
+        submit(run()).result()
+    finally:
+        worker.join(timeout=1.0)
 
 def start_reader(dev: Optional[BLEDevice]):
     if ss.reader_thread and ss.reader_thread.is_alive():
         return
     ss.stop_event = threading.Event()
     ss.last_error = ""
-    ss.data.clear()
-    ss.all_rows = []
+    ss.ring_head = 0
+    ss.session_n = 0
+    open_session_file(ss)
+    ss.rx_ring = SPSCRing(RX_CAPACITY)
     ss.download_bytes = b""
     ss.download_name = ""
     ss.acc_chart = None
@@ -278,7 +354,7 @@ def start_reader(dev: Optional[BLEDevice]):
     th = threading.Thread(
         target=ble_reader_thread,
         name="BLE-Reader",
-        args=(dev, ss.stop_event, ss.q_parsed, err_holder, conn_flag),
+        args=(dev, ss.stop_event, ss.rx_ring, err_holder, conn_flag),
         daemon=True
     )
     th.start()
@@ -288,14 +364,12 @@ def start_reader(dev: Optional[BLEDevice]):
     ss.last_error = err_holder[0]
     ss.connected = conn_flag[0]
 
-    # Fast-start seed
+    # Fast-start: give the first rows a moment so the first paint has data; the fragment pumps them
     t_deadline = time.time() + FAST_START_WAIT_S
     while time.time() < t_deadline:
-        if not ss.q_parsed.empty():
+        if len(ss.rx_ring):
             break
         time.sleep(0.02)
-    pump_queue_into_buffers(repeat=3)
-    st.rerun()
 
 def stop_reader_and_save():
     ev, th = ss.stop_event, ss.reader_thread
@@ -304,43 +378,53 @@ def stop_reader_and_save():
     ss.reader_thread = None
     ss.stop_event = None
     ss.connected = False
-    if ss.all_rows:
-        df = pd.DataFrame(ss.all_rows, columns=["t","ax","ay","az","gx","gy","gz"])
-        ss.download_bytes = df.to_csv(index=False).encode("utf-8")
+    pump_queue_into_buffers()  # rows that arrived after the last heartbeat
+    data = close_session_file(ss)
+    if ss.session_n:
+        ss.download_bytes = data
         ts = time.strftime("%Y%m%d_%H%M%S")
         ss.download_name = f"{CSV_NAME_BASE}_{ts}.csv"
         st.success("Data ready. Use the download button below.")
 
-def pump_queue_into_buffers(repeat: int = 1) -> int:
-    total = 0
-    for _ in range(max(1, repeat)):
-        added = 0
-        while True:
-            try:
-                row = ss.q_parsed.get_nowait()
-            except queue.Empty:
-                break
-            t, ax, ay, az, gx, gy, gz = row
-            t_rel = (time.time() - ss.t0) if ss.t0 else (t if t else 0.0)
-            full = (t_rel, ax, ay, az, gx, gy, gz)
-            ss.data.append(full)
-            ss.all_rows.append(full)
-            added += 1
-        total += added
-        if added == 0:
-            break
-        time.sleep(0.01)
-    return total
-
-# ---------------- Fixed placeholders (stable charts) ----------------
-if ss.acc_ph is None or ss.gyro_ph is None:
+def pump_queue_into_buffers() -> int:
+    """Move everything the reader has published into the ring and session log; never blocks."""
+    if ss.rx_ring is None:
+        return 0
+    arr = ss.rx_ring.read()
+    if not len(arr):
+        return 0
+    if ss.t0:
+        arr[:, 0] = time.time() - ss.t0
+    ring_write(ss, arr)
+    session_append(ss, arr)
+    return len(arr)
+
+# ---------------- Live charts (fragment) ----------------
+# Only this block reruns on the heartbeat; controls below rerun on user input only.
+@st.fragment(run_every=REFRESH_MS / 1000 if ss.connected else None)
+def live_view():
+    pump_queue_into_buffers()
     c1, c2 = st.columns(2)
-    with c1:
-        st.subheader("Acceleration — ax, ay, az")
-        ss.acc_ph = st.empty()
-    with c2:
-        st.subheader("Gyroscope — gx, gy, gz")
-        ss.gyro_ph = st.empty()
+    c1.subheader("Acceleration — ax, ay, az")
+    c2.subheader("Gyroscope — gx, gy, gz")
+
+    if ss.acc_chart is None and ss.ring_head:
+        rows0 = ring_since(ss, ss.ring_head - 1)
+        ss.acc_chart  = c1.line_chart(chart_delta(rows0, ACC_COLS, CHART_MAX_NEW), use_container_width=True)
+        ss.gyro_chart = c2.line_chart(chart_delta(rows0, GYRO_COLS, CHART_MAX_NEW), use_container_width=True)
+        ss.plotted_n = ss.ring_head
+    elif ss.acc_chart is not None:
+        # Send only the delta; called even when empty so the charts stay current
+        n_total = ss.ring_head
+        rows = ring_since(ss, ss.plotted_n)  # full resolution goes to the session file for the CSV
+        try:
+            ss.acc_chart.add_rows(chart_delta(rows, ACC_COLS, CHART_MAX_NEW))
+            ss.gyro_chart.add_rows(chart_delta(rows, GYRO_COLS, CHART_MAX_NEW))
+        except Exception as e:
+            ss.last_error = f"Chart update error: {e}"
+        ss.plotted_n = n_total
+
+live_view()
 
 # ---------------- Controls ----------------
 row1 = st.columns([1.2, 0.8, 1.1, 1.0, 2.2])
@@ -365,40 +449,18 @@ with row1[1]:
                 break
 
 with row1[2]:
-    start_clicked = st.button("Start", type="primary", disabled=ss.connected)  # no MAC needed
+    # on_click runs before the rerun the click triggers, so the fragment above already sees the new state
+    # (ignore MAC: we re-resolve by filter inside the thread just-in-time)
+    st.button("Start", type="primary", disabled=ss.connected,
+              on_click=lambda: start_reader(ss.selected_dev))
 with row1[3]:
     stop_clicked  = st.button("Stop", disabled=not ss.connected)
 with row1[4]:
     status = st.empty()
 
-if start_clicked:
-    # ignore MAC: we re-resolve by filter inside the thread just-in-time
-    start_reader(ss.selected_dev)
-
 if stop_clicked:
     stop_reader_and_save()
 
-# ---------------- Data pump & charts ----------------
-pump_queue_into_buffers(repeat=3)
-
-if ss.acc_chart is None and len(ss.data):
-    df0 = pd.DataFrame([ss.data[-1]], columns=["t","ax","ay","az","gx","gy","gz"]).set_index("t")
-    ss.acc_chart  = ss.acc_ph.line_chart(df0[["ax","ay","az"]], use_container_width=True)
-    ss.gyro_chart = ss.gyro_ph.line_chart(df0[["gx","gy","gz"]], use_container_width=True)
-    ss.plotted_n = len(ss.data)
-
-if ss.acc_chart is not None:
-    n_total = len(ss.data)
-    if n_total > ss.plotted_n:
-        new_slice = list(ss.data)[ss.plotted_n:n_total]
-        df_new = pd.DataFrame(new_slice, columns=["t","ax","ay","az","gx","gy","gz"]).set_index("t")
-        try:
-            ss.acc_chart.add_rows(df_new[["ax","ay","az"]])
-            ss.gyro_chart.add_rows(df_new[["gx","gy","gz"]])
-        except Exception as e:
-            ss.last_error = f"Chart update error: {e}"
-        ss.plotted_n = n_total
-
 # Status & download
 if ss.last_error:
     status.caption(f"⚠️ {ss.last_error}")
@@ -416,5 +478,3 @@ if ss.download_bytes:
         key="download_csv_ble",
     )
 
-if ss.connected:
-    st_autorefresh(interval=REFRESH_MS, key="ble_two_charts_refresh_fast")
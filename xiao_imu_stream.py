@@ -1,23 +1,27 @@
 # xiao_imu_two_charts.py  (fixed Stop → stable download button)
 
+import re
 import time
 import threading
-import queue
-from collections import deque
 from typing import Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import serial
 import serial.tools.list_ports
-from streamlit_autorefresh import st_autorefresh
+
+from imu_common import (ACC_COLS, GYRO_COLS, SPSCRing, chart_delta, parse_key_values,
+                        ring_write, ring_since, open_session_file, close_session_file, session_append)
 
 # ---------------- Config ----------------
 BAUD = 57600
 REFRESH_MS = 400             # UI refresh cadence
 RING = 2000                  # points kept on-screen
+CHART_REBUILD = 4 * RING     # appended rows before the charts are redrawn from the ring
+CHART_MAX_NEW = 200          # most points sent per chart per refresh (LTTB beyond this)
+RX_CAPACITY = 20000          # reader → UI records in flight
 CSV_PATH = "data_xiao.csv"
-EXPECTED_KEYS = ("ax","ay","az","gx","gy","gz")
 
 st.set_page_config(page_title="XIAO Sense IMU — Two Charts", layout="wide")
 st.title("XIAO nRF52840 Sense — IMU (two charts)")
@@ -31,39 +35,64 @@ ss.setdefault("ser_open", False)
 ss.setdefault("last_error", "")
 ss.setdefault("t0", None)
 
-# thread → UI queues and buffers
-ss.setdefault("q_parsed", queue.Queue(maxsize=20000))                 # (0, ax, ay, az, gx, gy, gz)
-ss.setdefault("data", deque(maxlen=RING))                             # (t, ax..gz)
-ss.setdefault("all_rows", [])                                         # accumulated session
+# thread → UI ring and buffers
+ss.setdefault("rx_ring", None)                                        # SPSCRing of (t, ax..gz) records
+ss.setdefault("ring", np.empty((RING, 7), dtype=np.float32))          # (t, ax..gz) on-screen window
+ss.setdefault("ring_head", 0)                                         # total rows written; slot is head % RING
+ss.setdefault("session_file", None)                                   # temp CSV the session is streamed into
+ss.setdefault("session_cleanup", None)                                # deletes session_file (also on session GC)
+ss.setdefault("session_n", 0)
+ss.setdefault("acc_chart", None)
+ss.setdefault("gyro_chart", None)
+ss.setdefault("plotted_n", 0)                                         # session rows already on the charts
+ss.setdefault("chart_base", 0)                                        # session_n when the charts were drawn
 
 # NEW: keep downloadable CSV in memory so Streamlit doesn't lose the handle
 ss.setdefault("download_bytes", b"")
 ss.setdefault("download_name", "data_xiao.csv")
 
+@st.cache_data(ttl=5.0, show_spinner=False)
 def list_ports_labels():
+    """COM ports as (label, device); enumeration is slow on Windows, so cached for 5 s."""
     return [(f"{p.device} — {p.description}", p.device) for p in serial.tools.list_ports.comports()]
 
-def parse_line(line: str) -> Optional[Tuple[float,float,float,float,float,float,float]]:
+def parse_line(line: bytes) -> Optional[Tuple[float,float,float,float,float,float,float]]:
+    """Parse one raw line straight from bytes (float() accepts ASCII bytes; no decode)."""
     s = line.strip()
-    if not s or s.startswith("err"):
+    if not s or s.startswith(b"err"):
         return None
-    kv = {}
-    for tok in s.split():
-        if ":" not in tok: continue
-        k, v = tok.split(":", 1)
-        if k in EXPECTED_KEYS:
-            try: kv[k] = float(v)
-            except ValueError: return None
-    if all(k in kv for k in EXPECTED_KEYS):
-        return (0.0, kv["ax"], kv["ay"], kv["az"], kv["gx"], kv["gy"], kv["gz"])
-    return None
+    return parse_key_values(s)
+
+# Canonical firmware line; lets a whole block be matched and converted at once
+_LINE_RE = re.compile(rb"^ax:(\S+) ay:(\S+) az:(\S+) gx:(\S+) gy:(\S+) gz:(\S+)[ \t]*$", re.M)
+
+def parse_block(lines: list) -> np.ndarray:
+    """Parse complete lines in one pass; returns an (n, 7) float32 array (t column 0)."""
+    lines = [ln for ln in lines if ln.strip()]
+    out = np.zeros((len(lines), 7), dtype=np.float32)
+    if not lines:
+        return out
+    found = _LINE_RE.findall(b"\n".join(lines))
+    if len(found) == len(lines):
+        try:
+            out[:, 1:] = np.array(found, dtype=np.float32)
+            return out
+        except ValueError:
+            pass
+    # Slow path: other token order, extra tokens or bad values
+    rows = [r for r in (parse_line(ln) for ln in lines) if r]
+    return np.array(rows, dtype=np.float32).reshape(-1, 7)
 
 # ---------------- Reader thread (NO Streamlit calls) ----------------
-def reader_thread_fn(port: str, stop_event: threading.Event, q_parsed: "queue.Queue",
+def reader_thread_fn(port: str, stop_event: threading.Event, rx_ring: SPSCRing,
                      err_holder: list, ser_open_flag: list):
     ser = None
     try:
+        # timeout only bounds the wait for the *first* byte, so Stop stays responsive
         ser = serial.Serial(port, BAUD, timeout=0.05, write_timeout=0.3)
+        if hasattr(ser, "set_buffer_size"):  # Windows only
+            try: ser.set_buffer_size(rx_size=65536)
+            except Exception: pass
         try:
             ser.dtr = True; ser.rts = True  # helps Windows CDC
         except Exception:
@@ -73,33 +102,22 @@ def reader_thread_fn(port: str, stop_event: threading.Event, q_parsed: "queue.Qu
         try: ser.reset_input_buffer()
         except Exception: pass
 
-        buf = bytearray()
+        buf = b""  # trailing partial line carried to the next read
         while not stop_event.is_set():
             try:
-                chunk = ser.read(256)
+                # block until data arrives, then take everything already buffered
+                chunk = ser.read(max(1, ser.in_waiting))
             except Exception as e:
                 err_holder[:] = [f"Read error: {e}"]
                 break
             if chunk:
-                buf += chunk
-                # split on CR/LF
-                while True:
-                    npos = buf.find(b"\n"); rpos = buf.find(b"\r")
-                    term = -1
-                    if npos != -1 and rpos != -1: term = min(npos, rpos)
-                    elif npos != -1: term = npos
-                    elif rpos != -1: term = rpos
-                    if term == -1: break
-                    line = buf[:term].decode(errors="ignore")
-                    drop = term + 1
-                    if drop < len(buf) and buf[drop:drop+1] in (b"\n", b"\r"): drop += 1
-                    del buf[:drop]
-                    parsed = parse_line(line)
-                    if parsed:
-                        try: q_parsed.put_nowait(parsed)
-                        except queue.Full: pass
-            # 20 ms pause for smoother visualisation / CPU relief
-            time.sleep(0.02)
+                # split on CR/LF in one pass; carry the trailing partial line
+                lines = (buf + chunk).replace(b"\r", b"\n").split(b"\n")
+                buf = lines.pop()
+                # one (k, 7) slice per read instead of one tuple per line
+                parsed = parse_block(lines)
+                if len(parsed):
+                    rx_ring.write(parsed)
     except Exception as e:
         err_holder[:] = [f"{type(e).__name__}: {e}"]
     finally:
@@ -114,8 +132,12 @@ def start_reader(port: str):
         return
     ss.stop_event = threading.Event()
     ss.last_error = ""
-    ss.data.clear()
-    ss.all_rows = []
+    ss.ring_head = 0
+    ss.session_n = 0
+    open_session_file(ss)
+    ss.rx_ring = SPSCRing(RX_CAPACITY)
+    ss.acc_chart = None
+    ss.gyro_chart = None
     ss.download_bytes = b""  # clear any previous download
     ss.download_name = "data_xiao.csv"
     ss.t0 = time.time()
@@ -125,7 +147,7 @@ def start_reader(port: str):
     th = threading.Thread(
         target=reader_thread_fn,
         name="USB-Serial-Reader",
-        args=(port, ss.stop_event, ss.q_parsed, err_holder, ser_open_flag),
+        args=(port, ss.stop_event, ss.rx_ring, err_holder, ser_open_flag),
         daemon=True
     )
     th.start()
@@ -144,38 +166,35 @@ def stop_reader_and_save():
     ss.stop_event = None
     ss.ser_open = False
 
-    # Build CSV once (bytes) and also write to disk (optional)
-    if ss.all_rows:
-        df = pd.DataFrame(ss.all_rows, columns=["t","ax","ay","az","gx","gy","gz"])
+    # The CSV was written during acquisition; read it back once (bytes) and also copy to disk (optional)
+    pump_queue_into_buffers()  # rows that arrived after the last heartbeat
+    data = close_session_file(ss)
+    if ss.session_n:
+        # keep bytes in memory for a stable download button
+        ss.download_bytes = data
         # save to disk (optional; nice to have)
         try:
-            df.to_csv(CSV_PATH, index=False)
+            with open(CSV_PATH, "wb") as f:
+                f.write(ss.download_bytes)
         except Exception:
             pass
-        # keep bytes in memory for a stable download button
-        ss.download_bytes = df.to_csv(index=False).encode("utf-8")
         # timestamped filename is helpful
         ts = time.strftime("%Y%m%d_%H%M%S")
         ss.download_name = f"data_xiao_{ts}.csv"
         st.success("Data saved. Use the download button below.")
 
-def pump_queue_into_buffers():
-    new_rows = []
-    while True:
-        try:
-            row = ss.q_parsed.get_nowait()
-        except queue.Empty:
-            break
-        _, ax, ay, az, gx, gy, gz = row
-        t_rel = time.time() - ss.t0 if ss.t0 else 0.0
-        full = (t_rel, ax, ay, az, gx, gy, gz)
-        ss.data.append(full)
-        ss.all_rows.append(full)
-        new_rows.append(full)
-    return new_rows
+def pump_queue_into_buffers() -> np.ndarray:
+    if ss.rx_ring is None:
+        return np.empty((0, 7), dtype=np.float32)
+    arr = ss.rx_ring.read()
+    if len(arr):
+        arr[:, 0] = time.time() - ss.t0 if ss.t0 else 0.0
+        ring_write(ss, arr)
+        session_append(ss, arr)
+    return arr
 
 # ---------------- UI: controls ----------------
-col1, col2, col3 = st.columns([2.6, 1.0, 1.0])
+col1, col2, col3, col4 = st.columns([2.6, 1.0, 1.0, 1.0])
 with col1:
     items = list_ports_labels()
     labels = [lbl for (lbl, dev) in items]
@@ -192,6 +211,10 @@ with col2:
     start_clicked = st.button("Start", type="primary")
 with col3:
     stop_clicked = st.button("Stop")
+with col4:
+    if st.button("Refresh ports"):
+        list_ports_labels.clear()
+        st.rerun()
 
 if start_clicked:
     if not ss.selected_port:
@@ -202,21 +225,32 @@ if start_clicked:
 if stop_clicked:
     stop_reader_and_save()
 
-# Drain any incoming samples
-_ = pump_queue_into_buffers()
-
-# ---------------- Two charts only ----------------
-if ss.data:
-    df = pd.DataFrame(list(ss.data), columns=["t","ax","ay","az","gx","gy","gz"]).set_index("t")
+# ---------------- Two charts only (fragment) ----------------
+# Only this block reruns on the heartbeat; controls above rerun on user input only.
+@st.fragment(run_every=REFRESH_MS / 1000 if ss.ser_open else None)
+def live_view():
+    # Drain any incoming samples
+    pump_queue_into_buffers()
+    if not ss.session_n:
+        st.info("Press Start to begin streaming.")
+        return
     c1, c2 = st.columns(2)
-    with c1:
-        st.subheader("Acceleration (ax, ay, az)")
-        st.line_chart(df[["ax","ay","az"]], use_container_width=True)
-    with c2:
-        st.subheader("Gyroscope (gx, gy, gz)")
-        st.line_chart(df[["gx","gy","gz"]], use_container_width=True)
-else:
-    st.info("Press Start to begin streaming.")
+    c1.subheader("Acceleration (ax, ay, az)")
+    c2.subheader("Gyroscope (gx, gy, gz)")
+    if ss.acc_chart is None or ss.session_n - ss.chart_base > CHART_REBUILD:
+        # First paint or chart grown well past the window: redraw from the ring
+        rows = ring_since(ss, ss.ring_head - RING)
+        ss.acc_chart = c1.line_chart(chart_delta(rows, ACC_COLS, RING), use_container_width=True)
+        ss.gyro_chart = c2.line_chart(chart_delta(rows, GYRO_COLS, RING), use_container_width=True)
+        ss.chart_base = ss.session_n
+    else:
+        # Send only the rows added since the last paint (LTTB-reduced); called even when empty so the charts stay current
+        rows = ring_since(ss, ss.plotted_n)
+        ss.acc_chart.add_rows(chart_delta(rows, ACC_COLS, CHART_MAX_NEW))
+        ss.gyro_chart.add_rows(chart_delta(rows, GYRO_COLS, CHART_MAX_NEW))
+    ss.plotted_n = ss.session_n
+
+live_view()
 
 # brief status
 if ss.last_error:
@@ -235,7 +269,3 @@ if ss.download_bytes:
         mime="text/csv",
         key="download_csv_stable",
     )
-
-# gentle auto-refresh while reading
-if ss.ser_open:
-    st_autorefresh(interval=REFRESH_MS, key="imu_two_charts_refresh")
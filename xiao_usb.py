@@ -1,16 +1,21 @@
 # xiao_usb_live.py
+import re
 import serial, serial.tools.list_ports
+import numpy as np
 import pandas as pd
 from collections import deque
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 
 # ---------------- Config ----------------
 DEFAULT_BAUD = 115200
 MAX_POINTS = 500
 REFRESH_MS = 200
+CHART_REBUILD = 4 * MAX_POINTS   # appended rows before the chart is redrawn from `data`
 CSV_HEADER = ["t","v1","v2"]
 
+_NUM = r"\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*"
+_ROW_RE = re.compile(",".join([_NUM] * len(CSV_HEADER)))  # exactly one float per column
+
 st.set_page_config(page_title="XIAO USB Live", layout="wide")
 st.title("Live USB data from XIAO nRF52840 Sense")
 
@@ -21,27 +26,39 @@ if "buffer" not in st.session_state:
     st.session_state.buffer = ""
 if "data" not in st.session_state:
     st.session_state.data = deque(maxlen=MAX_POINTS)
+if "chart" not in st.session_state:
+    st.session_state.chart = None
+    st.session_state.chart_rows = 0   # rows appended since the chart was drawn
+
+@st.cache_data(ttl=5.0, show_spinner=False)
+def list_port_devices():
+    """COM port names; enumeration is slow on Windows, so cached for 5 s."""
+    return [p.device for p in serial.tools.list_ports.comports()]
 
 # ---------------- UI ----------------
-ports = [p.device for p in serial.tools.list_ports.comports()]
-col1, col2, col3 = st.columns([2,1,1])
+ports = list_port_devices()
+col1, col2, col3, col4 = st.columns([2,1,1,1])
 with col1:
     port = st.selectbox("Port", options=ports, placeholder="Pick COM port")
 with col2:
     baud = st.number_input("Baud", value=DEFAULT_BAUD, step=1200)
 with col3:
     start = st.toggle("Start", value=False)
+with col4:
+    if st.button("Refresh ports"):
+        list_port_devices.clear()
+        st.rerun()
 
 status = st.empty()
 
+def chart_frame(rows) -> pd.DataFrame:
+    arr = np.asarray(rows, dtype=float).reshape(-1, len(CSV_HEADER))
+    return pd.DataFrame(arr[:, 1:], index=pd.Index(arr[:, 0], name="t"), columns=CSV_HEADER[1:])
+
 def try_parse(line):
-    try:
-        vals = [float(x) for x in line.strip().split(",")]
-        if len(vals) == len(CSV_HEADER):
-            return tuple(vals)
-    except:
-        return None
-    return None
+    # A failed fullmatch is one C-level scan; no exception is raised for blank or malformed lines
+    m = _ROW_RE.fullmatch(line.strip())
+    return tuple(map(float, m.groups())) if m else None
 
 # ---------------- Connect / Disconnect ----------------
 if start and port:
@@ -50,6 +67,7 @@ if start and port:
             st.session_state.ser = serial.Serial(port, baud, timeout=0.05)
             st.session_state.data.clear()
             st.session_state.buffer = ""
+            st.session_state.chart = None
             status.success(f"Connected to {port}")
         except Exception as e:
             status.error(f"Open failed: {e}")
@@ -62,33 +80,42 @@ else:
     status.info("Not connected.")
     st.stop()
 
-# ---------------- Read new data ----------------
-ser = st.session_state.ser
-if ser and ser.in_waiting:
-    chunk = ser.read(ser.in_waiting).decode(errors="ignore")
-    st.session_state.buffer += chunk
-    if "\n" in st.session_state.buffer:
-        lines = st.session_state.buffer.splitlines()
-        if not st.session_state.buffer.endswith("\n"):
-            st.session_state.buffer = lines.pop()
-        else:
-            st.session_state.buffer = ""
-        for ln in lines:
-            parsed = try_parse(ln)
-            if parsed:
-                st.session_state.data.append(parsed)
+# ---------------- Read & show (fragment) ----------------
+# Only this block reruns on the heartbeat; port/baud widgets rerun on user input only.
+@st.fragment(run_every=REFRESH_MS / 1000)
+def live_view():
+    ser = st.session_state.ser
+    new_rows = []
+    if ser and ser.in_waiting:
+        chunk = ser.read(ser.in_waiting).decode(errors="ignore")
+        st.session_state.buffer += chunk
+        if "\n" in st.session_state.buffer:
+            lines = st.session_state.buffer.splitlines()
+            if not st.session_state.buffer.endswith("\n"):
+                st.session_state.buffer = lines.pop()
+            else:
+                st.session_state.buffer = ""
+            for ln in lines:
+                parsed = try_parse(ln)
+                if parsed:
+                    new_rows.append(parsed)
+            st.session_state.data.extend(new_rows)
 
-# ---------------- Show data live ----------------
-if st.session_state.data:
-    df = pd.DataFrame(st.session_state.data, columns=CSV_HEADER)
-    st.subheader("Live feed (last 10 lines)")
-    tail = df.tail(10).to_string(index=False)
-    st.code(tail, language="text")
+    data = st.session_state.data
+    if data:
+        st.subheader("Live feed (last 10 lines)")
+        tail = pd.DataFrame([data[i] for i in range(max(0, len(data) - 10), len(data))], columns=CSV_HEADER)
+        st.code(tail.to_string(index=False), language="text")
 
-    st.subheader("Live chart")
-    st.line_chart(df.set_index("t")[["v1","v2"]])
-else:
-    st.info("Waiting for data...")
+        st.subheader("Live chart")
+        if st.session_state.chart is None or st.session_state.chart_rows > CHART_REBUILD:
+            st.session_state.chart = st.line_chart(chart_frame(data))
+            st.session_state.chart_rows = 0
+        else:
+            # Send only this tick's rows; called even when empty so the chart stays current
+            st.session_state.chart.add_rows(chart_frame(new_rows))
+            st.session_state.chart_rows += len(new_rows)
+    else:
+        st.info("Waiting for data...")
 
-# ---------------- Auto refresh ----------------
-st_autorefresh(interval=REFRESH_MS, key="usb_refresh")
+live_view()
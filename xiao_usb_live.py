@@ -2,28 +2,44 @@
 # Expects newline CSV: t,ax,ay,az,gx,gy,gz  (floats)
 # Shows live accel/gyro charts + tail + stats. Threaded reader (no Streamlit calls in thread).
 
+import os
+import sys
 import time
 import threading
-import queue
 from collections import deque
 from typing import Deque, Tuple, Optional
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import serial
 import serial.tools.list_ports
 
-try:
-    from streamlit_autorefresh import st_autorefresh
-except Exception:
-    st_autorefresh = None
+from csv_kernel import parse_rows, parse_lines, fromstring_rows  # parse_rows is None without Numba
+from imu_common import open_temp_csv, csv_bytes, ring_write, ring_since
 
 # ---------------- Config ----------------
 CSV_HEADER = ["t", "ax", "ay", "az", "gx", "gy", "gz"]  # <— IMU columns
 DEFAULT_BAUD = 115200
-REFRESH_MS = 200
+REFRESH_MS = 200              # UI heartbeat while data is flowing
+IDLE_REFRESH_MS = 1000        # UI heartbeat while the link is quiet
 MAX_POINTS = 5000             # ring buffer for live view
+CHART_REBUILD = 4 * MAX_POINTS  # appended rows before the charts are redrawn from the ring
 RAW_TAIL_BYTES = 256
+QUEUE_MAX = 10000             # reader → UI batches in flight
+RAW_FLUSH_BYTES = 4096        # raw bytes coalesced per q_raw entry ...
+RAW_FLUSH_S = 0.05            # ... or at most this long
+READ_MAX = 8192               # most bytes taken per serial read
+SWITCH_INTERVAL_S = 0.001     # GIL hand-off interval while a reader runs, so it wakes promptly after ser.read
+
+# Binary framing (needs matching firmware): each frame is FRAME_SYNC followed by
+# t,ax,ay,az,gx,gy,gz as little-endian float32 — 32 bytes, no text parsing.
+BINARY_MODE = False
+FRAME_SYNC = b"\xA5\x5A\xA5\x5A"
+FRAME_DTYPE = np.dtype([("sync", "<u4"), ("v", "<f4", (7,))])
+
+# bytes.translate table for the raw tail's text line: printable ASCII kept, everything else shown as '.'
+PRINTABLE_TABLE = bytes(b if 32 <= b <= 126 else 0x2E for b in range(256))
 
 st.set_page_config(page_title="XIAO USB Live (IMU + CSV logging)", layout="wide")
 st.title("XIAO nRF52840 Sense — USB live IMU stream (with CSV logging)")
@@ -35,12 +51,24 @@ if "stop_event" not in st.session_state:
     st.session_state.stop_event: Optional[threading.Event] = None
 if "ser_open" not in st.session_state:
     st.session_state.ser_open = False
+if "data_event" not in st.session_state:
+    st.session_state.data_event = threading.Event()   # set by the reader when it queues anything
+    st.session_state.streaming = False                 # heartbeat currently at REFRESH_MS
 
 # live buffers (main thread owns these)
-if "parsed" not in st.session_state:
-    st.session_state.parsed: Deque[Tuple[float, ...]] = deque(maxlen=MAX_POINTS)
+if "ring" not in st.session_state:
+    st.session_state.ring = np.empty((MAX_POINTS, 7))   # (t, ax..gz) live window
+    st.session_state.ring_head = 0                     # total rows written; slot is head % MAX_POINTS
+if "frame" not in st.session_state:
+    st.session_state.frame = None                      # (acc, gyro) chart frames built from the ring
+    st.session_state.frame_head = -1                   # ring_head the frame was built at
+if "acc_chart" not in st.session_state:
+    st.session_state.acc_chart = None                  # persistent chart handles (add_rows targets)
+    st.session_state.gyro_chart = None
+    st.session_state.plotted_n = 0                     # ring_head already on the charts
+    st.session_state.chart_base = 0                    # ring_head when the charts were drawn
 if "raw_tail" not in st.session_state:
-    st.session_state.raw_tail = bytearray()
+    st.session_state.raw_tail: Deque[int] = deque(maxlen=RAW_TAIL_BYTES)  # oldest bytes fall off
 if "bytes_total" not in st.session_state:
     st.session_state.bytes_total = 0
 if "lines_total" not in st.session_state:
@@ -50,17 +78,21 @@ if "last_rx_ts" not in st.session_state:
 if "last_error" not in st.session_state:
     st.session_state.last_error = ""
 
-# queues from thread → main
+# queues from thread → main (deque append/popleft are atomic; when full the oldest entry is dropped)
 if "q_parsed" not in st.session_state:
-    st.session_state.q_parsed: "queue.Queue[Tuple[float, ...]]" = queue.Queue(maxsize=10000)
+    st.session_state.q_parsed: Deque[np.ndarray] = deque(maxlen=QUEUE_MAX)
 if "q_raw" not in st.session_state:
-    st.session_state.q_raw: "queue.Queue[bytes]" = queue.Queue(maxsize=10000)
+    st.session_state.q_raw: Deque[bytes] = deque(maxlen=QUEUE_MAX)
 
 # logging state
 if "logging" not in st.session_state:
     st.session_state.logging = False
-if "log_rows" not in st.session_state:
-    st.session_state.log_rows: list[Tuple[float, ...]] = []
+if "log_file" not in st.session_state:
+    st.session_state.log_file = None     # temp CSV the parsed rows are streamed into while logging
+    st.session_state.log_cleanup = None  # deletes log_file (also on session GC)
+    st.session_state.log_n = 0
+if "log_bytes" not in st.session_state:
+    st.session_state.log_bytes = b""     # filled only when a download is prepared
 
 # ---------------- Helpers ----------------
 def list_ports():
@@ -69,30 +101,142 @@ def list_ports():
         items.append((f"{p.device} — {p.description}", p.device))
     return items
 
-def try_parse(line: str) -> Optional[Tuple[float, ...]]:
-    s = line.strip()
-    if not s or s.startswith("#"):
-        return None
-    parts = s.split(",")
-    if len(parts) < len(CSV_HEADER):
-        return None
-    try:
-        vals = tuple(float(x) for x in parts[:len(CSV_HEADER)])
-        return vals
-    except ValueError:
-        return None
+def _make_try_parse(ncols: int):
+    """Build try_parse for a fixed `ncols`-wide row, with the float() calls unrolled in the source."""
+    fields = ", ".join(f"_float(parts[{i}])" for i in range(ncols))
+    src = (
+        "def try_parse(line: str, _float=float) -> Optional[Tuple[float, ...]]:\n"
+        "    s = line.strip()\n"
+        "    if not s or s.startswith('#'):\n"
+        "        return None\n"
+        f"    parts = s.split(',', {ncols})\n"
+        f"    if len(parts) < {ncols}:\n"
+        "        return None\n"
+        "    try:\n"
+        f"        return ({fields})\n"
+        "    except ValueError:\n"
+        "        return None\n"
+    )
+    ns = {"Optional": Optional, "Tuple": Tuple}
+    exec(compile(src, f"<try_parse{ncols}>", "exec"), ns)
+    return ns["try_parse"]
+
+# Split at most len(CSV_HEADER) times (extra fields stay in the last piece) and convert by position
+try_parse = _make_try_parse(len(CSV_HEADER))
+
+def _try_parse_bytes(line: bytes) -> Optional[Tuple[float, ...]]:
+    return try_parse(line.decode("ascii", "ignore"))
+
+def parse_csv_block(lines: list) -> np.ndarray:
+    """Parse complete lines in one pass; returns an (n, 7) float64 array of t,ax..gz."""
+    lines = [ln for ln in lines if ln]
+    if not lines:
+        return np.empty((0, 7))
+    if parse_rows is not None:
+        # Whole block in one compiled call; comments and odd rows go to try_parse
+        return parse_lines(lines, 7, _try_parse_bytes)
+    arr = fromstring_rows(lines, 7)
+    if arr is not None:
+        return arr
+    # Slow path: comments or malformed/extra-width rows
+    rows = [r for r in (_try_parse_bytes(ln) for ln in lines) if r]
+    return np.array(rows, dtype=np.float64).reshape(-1, 7)
+
+_SYNC_WORD = int.from_bytes(FRAME_SYNC, "little")
+
+def _frames_rows(parts: list) -> np.ndarray:
+    return np.concatenate(parts).astype(np.float64) if parts else np.empty((0, 7))
+
+def parse_frames(buf: bytes) -> Tuple[np.ndarray, bytes]:
+    """Decode binary frames from `buf`; returns ((n, 7) float64 rows, unconsumed tail).
+
+    Bytes before a sync word are dropped; a frame whose sync is wrong triggers a
+    rescan from the byte after it, so the reader resynchronises after a glitch.
+    """
+    out = []
+    i = buf.find(FRAME_SYNC)
+    while i >= 0:
+        n = (len(buf) - i) // FRAME_DTYPE.itemsize
+        if n == 0:
+            break
+        frames = np.frombuffer(buf, dtype=FRAME_DTYPE, count=n, offset=i)
+        bad = np.flatnonzero(frames["sync"] != _SYNC_WORD)
+        good = bad[0] if len(bad) else n
+        out.append(frames["v"][:good])
+        i += good * FRAME_DTYPE.itemsize
+        if len(bad):
+            i = buf.find(FRAME_SYNC, i + 1)
+    else:
+        # no sync left: keep only a possible partial sync word at the end
+        return _frames_rows(out), buf[-(len(FRAME_SYNC) - 1):]
+    return _frames_rows(out), buf[i:]
+
+def chart_frames(rows: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Acc and gyro frames over column views of `rows`, both indexed by t."""
+    t = pd.Index(rows[:, 0], name="t")
+    acc = pd.DataFrame(rows[:, 1:4], index=t, columns=CSV_HEADER[1:4], copy=False)
+    gyro = pd.DataFrame(rows[:, 4:7], index=t, columns=CSV_HEADER[4:7], copy=False)
+    return acc, gyro
+
+def live_frames() -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Acc/gyro frames of the live window; rebuilt only when new rows have arrived since the last refresh."""
+    if st.session_state.frame_head != st.session_state.ring_head:
+        rows = ring_since(st.session_state, st.session_state.ring_head - MAX_POINTS)
+        st.session_state.frame = chart_frames(rows)
+        st.session_state.frame_head = st.session_state.ring_head
+    return st.session_state.frame
+
+class SwitchInterval:
+    """Process-wide sys.setswitchinterval for running readers.
+
+    The interval is interpreter-wide, so it is reference-counted: the first reader to
+    start lowers it to SWITCH_INTERVAL_S, the last one to stop restores the old value.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+        self.saved = sys.getswitchinterval()
+
+    def acquire(self):
+        with self.lock:
+            if self.users == 0:
+                self.saved = sys.getswitchinterval()
+                sys.setswitchinterval(SWITCH_INTERVAL_S)
+            self.users += 1
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            if self.users == 0:
+                sys.setswitchinterval(self.saved)
+
+@st.cache_resource
+def switch_interval() -> SwitchInterval:
+    """One counter per server process, shared by every session's reader."""
+    return SwitchInterval()
 
 def reader_thread_fn(port: str, baud: int, stop_event: threading.Event,
-                     q_parsed: queue.Queue, q_raw: queue.Queue,
-                     err_holder: list, ser_open_flag: list):
+                     q_parsed: deque, q_raw: deque, data_event: threading.Event,
+                     err_holder: list, ser_open_flag: list, switch: SwitchInterval):
     """Background reader — NO Streamlit calls here."""
     ser = None
+    if hasattr(os, "sched_setaffinity"):  # Linux only
+        # pid 0 is the calling thread on Linux, so this pins only this reader thread
+        # (to the last logical CPU), not the Streamlit server process
+        try:
+            os.sched_setaffinity(0, {os.cpu_count() - 1})
+        except OSError:
+            pass
+    switch.acquire()
     try:
         ser = serial.Serial(
             port=port, baudrate=baud,
             timeout=0.5, write_timeout=0.5,
             rtscts=False, dsrdtr=False, xonxoff=False
         )
+        if hasattr(ser, "set_buffer_size"):  # Windows only: larger driver buffer
+            try: ser.set_buffer_size(rx_size=65536)
+            except Exception: pass
         # Assert DTR/RTS (helps some Windows CDC drivers begin streaming)
         try:
             ser.dtr = True
@@ -104,43 +248,37 @@ def reader_thread_fn(port: str, baud: int, stop_event: threading.Event,
         time.sleep(0.2)
         ser.reset_input_buffer()
 
-        buf = bytearray()
+        buf = b""  # trailing partial line carried to the next read
+        raw_accum = bytearray()  # raw bytes not yet handed to the UI
+        last_flush = time.monotonic()
         while not stop_event.is_set():
-            chunk = ser.read(256)  # blocks up to 0.5s
-            if chunk:
-                # push raw bytes
-                try:
-                    q_raw.put_nowait(chunk)
-                except queue.Full:
-                    pass
-
-                buf += chunk
-                # split on CR or LF
-                while True:
-                    npos = buf.find(b"\n")
-                    rpos = buf.find(b"\r")
-                    term = -1
-                    if npos != -1 and rpos != -1:
-                        term = min(npos, rpos)
-                    elif npos != -1:
-                        term = npos
-                    elif rpos != -1:
-                        term = rpos
-                    if term == -1:
-                        break
-
-                    line = buf[:term].decode(errors="ignore")
-                    drop = term + 1
-                    if drop < len(buf) and buf[drop:drop+1] in (b"\n", b"\r"):
-                        drop += 1
-                    del buf[:drop]
-
-                    parsed = try_parse(line)
-                    if parsed:
-                        try:
-                            q_parsed.put_nowait(parsed)
-                        except queue.Full:
-                            pass
+            # block (up to 0.5s) for the first byte, then take everything already buffered
+            chunk = ser.read(min(max(1, ser.in_waiting), READ_MAX))
+            raw_accum += chunk
+            # push raw bytes in coalesced blocks; flush at once when the UI has drained
+            # everything (it is waiting) or when the link goes quiet
+            now = time.monotonic()
+            if raw_accum and (not q_raw or not chunk or len(raw_accum) >= RAW_FLUSH_BYTES
+                              or now - last_flush >= RAW_FLUSH_S):
+                q_raw.append(bytes(raw_accum))
+                raw_accum.clear()
+                last_flush = now
+                data_event.set()
+            if chunk and BINARY_MODE:
+                rows, buf = parse_frames(buf + chunk)
+                if len(rows):
+                    q_parsed.append(rows)
+                    data_event.set()
+            elif chunk:
+                # One pass: CR -> LF, split (memchr-backed), carry the trailing partial line;
+                # the empty piece a CRLF leaves behind is skipped by try_parse
+                pieces = (buf + chunk).replace(b"\r", b"\n").split(b"\n")
+                buf = pieces.pop()
+                # one queue op per read: the rows parsed from this chunk go as one (k, 7) array
+                rows = parse_csv_block(pieces)
+                if len(rows):
+                    q_parsed.append(rows)
+                    data_event.set()
     except Exception as e:
         err_holder[:] = [f"{type(e).__name__}: {e}"]
     finally:
@@ -150,14 +288,17 @@ def reader_thread_fn(port: str, baud: int, stop_event: threading.Event,
         except:
             pass
         ser_open_flag[:] = [False]
+        switch.release()
 
 def start_reader(port: str, baud: int):
     if st.session_state.reader_thread and st.session_state.reader_thread.is_alive():
         return
     st.session_state.stop_event = threading.Event()
     st.session_state.last_error = ""
-    st.session_state.parsed.clear()
-    st.session_state.raw_tail = bytearray()
+    st.session_state.ring_head = 0
+    st.session_state.frame_head = -1
+    st.session_state.acc_chart = None
+    st.session_state.raw_tail.clear()
     st.session_state.bytes_total = 0
     st.session_state.lines_total = 0
     st.session_state.last_rx_ts = 0.0
@@ -171,8 +312,8 @@ def start_reader(port: str, baud: int):
         target=reader_thread_fn,
         name="USB-Serial-Reader",
         args=(port, baud, st.session_state.stop_event,
-              st.session_state.q_parsed, st.session_state.q_raw,
-              err_holder, ser_open_flag),
+              st.session_state.q_parsed, st.session_state.q_raw, st.session_state.data_event,
+              err_holder, ser_open_flag, switch_interval()),
         daemon=True
     )
     th.start()
@@ -193,31 +334,52 @@ def stop_reader():
     st.session_state.stop_event = None
     st.session_state.ser_open = False
 
+def open_log_file():
+    """Fresh on-disk log with the CSV_HEADER header; rows are appended as they arrive."""
+    close_log_file()
+    st.session_state.log_file, st.session_state.log_cleanup = open_temp_csv(CSV_HEADER, buffering=1 << 16)
+    st.session_state.log_n = 0
+
+def close_log_file():
+    """Close and delete the log file, dropping its rows."""
+    f, st.session_state.log_file = st.session_state.log_file, None
+    st.session_state.log_n = 0
+    st.session_state.log_bytes = b""
+    if f is not None:
+        st.session_state.log_cleanup()
+
+def log_append(rows: np.ndarray) -> None:
+    """Append (n, 7) parsed rows to the log file as CSV (buffered; nothing is kept in RAM)."""
+    st.session_state.log_file.write(csv_bytes(rows, "%.10g"))
+    st.session_state.log_n += len(rows)
+
+def read_log_bytes() -> bytes:
+    """The log so far (header + rows), read back from disk."""
+    f = st.session_state.log_file
+    f.flush()
+    with open(f.name, "rb") as fh:
+        return fh.read()
+
 def pump_queues():
     """Drain thread queues into main-thread buffers and (optionally) the log."""
-    # raw bytes
-    while True:
-        try:
-            ch = st.session_state.q_raw.get_nowait()
-        except queue.Empty:
-            break
-        st.session_state.bytes_total += len(ch)
+    # raw bytes: take everything queued, then update counters once
+    q_raw = st.session_state.q_raw
+    chunks = [q_raw.popleft() for _ in range(len(q_raw))]
+    if chunks:
+        st.session_state.bytes_total += sum(map(len, chunks))
         st.session_state.last_rx_ts = time.time()
-        st.session_state.raw_tail += ch
-        if len(st.session_state.raw_tail) > RAW_TAIL_BYTES:
-            st.session_state.raw_tail = st.session_state.raw_tail[-RAW_TAIL_BYTES:]
-
-    # parsed lines
-    while True:
-        try:
-            row = st.session_state.q_parsed.get_nowait()
-        except queue.Empty:
-            break
-        st.session_state.parsed.append(row)
-        st.session_state.lines_total += 1
+        st.session_state.raw_tail.extend(b"".join(chunks[-RAW_TAIL_BYTES:])[-RAW_TAIL_BYTES:])
+
+    # parsed lines (one array per reader chunk), written as a single block
+    q_parsed = st.session_state.q_parsed
+    batches = [q_parsed.popleft() for _ in range(len(q_parsed))]
+    if batches:
+        rows = batches[0] if len(batches) == 1 else np.concatenate(batches)
+        ring_write(st.session_state, rows)
+        st.session_state.lines_total += len(rows)
         st.session_state.last_rx_ts = time.time()
         if st.session_state.logging:
-            st.session_state.log_rows.append(row)
+            log_append(rows)
 
 # ---------------- UI: connection ----------------
 ports = list_ports()
@@ -234,8 +396,10 @@ with col3:
     start = st.toggle("Start", value=False, help="Open/close background reader")
 with col4:
     if st.button("Clear live data"):
-        st.session_state.parsed.clear()
-        st.session_state.raw_tail = bytearray()
+        st.session_state.ring_head = 0
+        st.session_state.frame_head = -1
+        st.session_state.acc_chart = None
+        st.session_state.raw_tail.clear()
         st.session_state.bytes_total = 0
         st.session_state.lines_total = 0
 
@@ -246,75 +410,113 @@ log_col1, log_col2, log_col3 = st.columns([1.2, 1.2, 2])
 with log_col1:
     st.session_state.logging = st.toggle("Logging", value=st.session_state.logging,
                                          help="When ON, incoming parsed rows are appended to the session log.")
+    if st.session_state.logging and st.session_state.log_file is None:
+        open_log_file()
 with log_col2:
     if st.button("Reset log"):
-        st.session_state.log_rows = []
+        close_log_file()
+        if st.session_state.logging:
+            open_log_file()
 
-# Connection / data pump
+# Connection
 if start and port:
     if not (st.session_state.reader_thread and st.session_state.reader_thread.is_alive()):
         start_reader(port, baud)
-
-    pump_queues()
-
-    if st.session_state.last_error:
-        status.error(st.session_state.last_error)
-    else:
-        since = (time.time() - st.session_state.last_rx_ts) if st.session_state.last_rx_ts else None
-        rx = f"(last RX {since:.1f}s ago)" if since is not None else "(waiting for first bytes…)"
-        status.success(f"Port {port} @ {baud} — {'open' if st.session_state.ser_open else 'opening…'} {rx}")
 else:
     stop_reader()
     status.info("Not connected.")
     st.stop()
 
-# ---------------- Live views ----------------
-left, right = st.columns([1, 2])
-
-with left:
-    st.subheader("Stats")
-    st.metric("Total raw bytes", st.session_state.bytes_total)
-    st.metric("Total parsed lines", st.session_state.lines_total)
-    if st.session_state.last_rx_ts:
-        st.caption(f"Last RX: {time.strftime('%H:%M:%S', time.localtime(st.session_state.last_rx_ts))}")
-
-    st.subheader("Raw bytes tail")
-    if st.session_state.raw_tail:
-        tail = bytes(st.session_state.raw_tail)
-        hexstr = " ".join(f"{b:02X}" for b in tail)
-        txtstr = "".join(chr(b) if 32 <= b <= 126 else "." for b in tail)
-        st.code(hexstr, language="text")
-        st.text(txtstr)
-    else:
-        st.caption("No raw bytes yet.")
-
-    st.subheader("Download log")
-    if st.session_state.log_rows:
-        df_log = pd.DataFrame(st.session_state.log_rows, columns=CSV_HEADER)
-        st.download_button(
-            "Download CSV",
-            data=df_log.to_csv(index=False).encode(),
-            file_name=f"xiao_imu_log_{int(time.time())}.csv",
-            mime="text/csv",
-        )
-    else:
-        st.caption("No logged rows yet. Toggle 'Logging' to start.")
-
-with right:
-    if st.session_state.parsed:
-        df = pd.DataFrame(st.session_state.parsed, columns=CSV_HEADER)
-        # Two charts: accel and gyro (each uses 't' as index)
-        st.subheader("Accelerometer (g or m/s²)")
-        st.line_chart(df.set_index("t")[["ax", "ay", "az"]])
+# ---------------- Live views (fragment) ----------------
+# Only this block reruns on the heartbeat; controls above rerun on user input only.
+# The heartbeat is fast while the reader keeps signalling new data and slow while the link is quiet.
+@st.fragment(run_every=(REFRESH_MS if st.session_state.streaming else IDLE_REFRESH_MS) / 1000)
+def live_view():
+    event = st.session_state.data_event
+    if event.is_set():
+        event.clear()  # cleared before draining, so a later append always re-signals
+        pump_queues()
 
-        st.subheader("Gyroscope (deg/s or rad/s)")
-        st.line_chart(df.set_index("t")[["gx", "gy", "gz"]])
-
-        st.subheader("Tail (last 10 parsed)")
-        st.code(df.tail(10).to_string(index=False), language="text")
+    if st.session_state.last_error:
+        st.error(st.session_state.last_error)
     else:
-        st.info("Parsed charts will appear when valid CSV lines arrive.")
-
-# ---------------- Auto refresh ----------------
-if st_autorefresh:
-    st_autorefresh(interval=REFRESH_MS, key="usb_refresh")
+        since = (time.time() - st.session_state.last_rx_ts) if st.session_state.last_rx_ts else None
+        rx = f"(last RX {since:.1f}s ago)" if since is not None else "(waiting for first bytes…)"
+        st.success(f"Port {port} @ {baud} — {'open' if st.session_state.ser_open else 'opening…'} {rx}")
+
+    left, right = st.columns([1, 2])
+
+    with left:
+        st.subheader("Stats")
+        st.metric("Total raw bytes", st.session_state.bytes_total)
+        st.metric("Total parsed lines", st.session_state.lines_total)
+        if st.session_state.last_rx_ts:
+            st.caption(f"Last RX: {time.strftime('%H:%M:%S', time.localtime(st.session_state.last_rx_ts))}")
+
+        st.subheader("Raw bytes tail")
+        if st.session_state.raw_tail:
+            tail = bytes(st.session_state.raw_tail)
+            hexstr = tail.hex(" ").upper()
+            txtstr = tail.translate(PRINTABLE_TABLE).decode("ascii")
+            st.code(hexstr, language="text")
+            st.text(txtstr)
+        else:
+            st.caption("No raw bytes yet.")
+
+        st.subheader("Download log")
+        if st.session_state.log_n:
+            # The file is only read back on request, not on every refresh. Fixed keys: a label
+            # or file name that changed between refreshes would give the button a new ID and drop clicks
+            st.caption(f"{st.session_state.log_n} rows logged")
+            if st.button("Prepare CSV", key="prep_csv"):
+                st.session_state.log_bytes = read_log_bytes()
+            if st.session_state.log_bytes:
+                st.download_button(
+                    "Download CSV",
+                    data=st.session_state.log_bytes,
+                    file_name=f"xiao_imu_log_{int(time.time())}.csv",
+                    mime="text/csv",
+                    key="download_log",
+                )
+        else:
+            st.caption("No logged rows yet. Toggle 'Logging' to start.")
+
+    with right:
+        if st.session_state.ring_head:
+            head = st.session_state.ring_head
+            rebuild = (st.session_state.acc_chart is None
+                       or head - st.session_state.chart_base > CHART_REBUILD)
+            # Two charts: accel and gyro (each uses 't' as index)
+            if rebuild:
+                # First paint or chart grown well past the window: redraw from the ring
+                acc, gyro = live_frames()
+            else:
+                # Send only the rows added since the last paint; called even when empty so the charts stay current
+                acc, gyro = chart_frames(ring_since(st.session_state, st.session_state.plotted_n))
+            st.subheader("Accelerometer (g or m/s²)")
+            if rebuild:
+                st.session_state.acc_chart = st.line_chart(acc)
+            else:
+                st.session_state.acc_chart.add_rows(acc)
+
+            st.subheader("Gyroscope (deg/s or rad/s)")
+            if rebuild:
+                st.session_state.gyro_chart = st.line_chart(gyro)
+                st.session_state.chart_base = head
+            else:
+                st.session_state.gyro_chart.add_rows(gyro)
+            st.session_state.plotted_n = head
+
+            st.subheader("Tail (last 10 parsed)")
+            tail = pd.DataFrame(ring_since(st.session_state, head - 10), columns=CSV_HEADER)
+            st.code(tail.to_string(index=False), language="text")
+        else:
+            st.info("Parsed charts will appear when valid CSV lines arrive.")
+
+    # Switch heartbeat when data starts or has been quiet for a second (full rerun re-registers the fragment)
+    streaming = bool(st.session_state.last_rx_ts) and time.time() - st.session_state.last_rx_ts < 1.0
+    if streaming != st.session_state.streaming:
+        st.session_state.streaming = streaming
+        st.rerun()
+
+live_view()